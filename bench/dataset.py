@@ -0,0 +1,70 @@
+import csv
+import hashlib
+from typing import Any, Dict, Iterator
+
+# Access point pools; records draw from them, so authorities are shared between records
+SUBJECTS = [f"Subject {n}" for n in range(500)]
+PLACES = [f"Place {n}" for n in range(200)]
+NAMES = [f"Agency {n}" for n in range(1000)]
+
+CSV_COLUMNS = (
+    "referenceCode", "identifier", "title", "levelOfDescription", "publicationStatus", "scopeAndContent",
+    "accessConditions", "extentAndMedium", "eventDates", "subjectAccessPoints", "placeAccessPoints",
+    "nameAccessPoints", "eventActors",
+)
+
+# Record n always has the same content, so datasets of any size are generated on the fly
+def _pick(pool, n: int, salt: int) -> str:
+    return pool[int(hashlib.md5(f"{n}:{salt}".encode()).hexdigest()[:8], 16) % len(pool)]
+
+def slug(n: int) -> str:
+    return f"bench-record-{n:06d}"
+
+def reference_code(n: int) -> str:
+    return f"GR-{n:06d}"
+
+def atom_detail(n: int, revision: int = 0) -> Dict[str, Any]:
+    """AtoM detail record ``n``; a different ``revision`` changes its title and text."""
+    suffix = f" (revision {revision})" if revision else ""
+    return {
+        "reference_code": reference_code(n),
+        "title": f"Benchmark series {n}{suffix}",
+        "level_of_description": "Series",
+        "publication_status": "Published",
+        "scope_and_content": f"Records of benchmark series {n}{suffix}. " + "Correspondence, reports and minutes. " * 8,
+        "conditions_governing_access": "Open for research.",
+        "extent_and_medium": f"{n % 40 + 1} boxes of textual records",
+        "dates": [{"date": f"{1900 + n % 100}-{1950 + n % 70}"}],
+        "subject_access_points": [_pick(SUBJECTS, n, 1), _pick(SUBJECTS, n, 2)],
+        "place_access_points": [_pick(PLACES, n, 3)],
+        "name_access_points": [_pick(NAMES, n, 4)],
+        "creators": [{"authotized_form_of_name": _pick(NAMES, n, 5)}],
+    }
+
+def csv_row(n: int) -> Dict[str, str]:
+    """The AtoM CSV export row holding the same record as ``atom_detail(n)``."""
+    d = atom_detail(n)
+    return {
+        "referenceCode": d["reference_code"],
+        "identifier": str(n),
+        "title": d["title"],
+        "levelOfDescription": d["level_of_description"],
+        "publicationStatus": d["publication_status"],
+        "scopeAndContent": d["scope_and_content"],
+        "accessConditions": d["conditions_governing_access"],
+        "extentAndMedium": d["extent_and_medium"],
+        "eventDates": d["dates"][0]["date"],
+        "subjectAccessPoints": "|".join(d["subject_access_points"]),
+        "placeAccessPoints": "|".join(d["place_access_points"]),
+        "nameAccessPoints": "|".join(d["name_access_points"]),
+        "eventActors": "|".join(c["authotized_form_of_name"] for c in d["creators"]),
+    }
+
+def csv_rows(count: int) -> Iterator[Dict[str, str]]:
+    return (csv_row(n) for n in range(count))
+
+def write_csv(path: str, count: int) -> None:
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS)
+        writer.writeheader()
+        writer.writerows(csv_rows(count))
@@ -0,0 +1,172 @@
+import argparse
+import json
+import re
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import dataset
+from mock_server import MockHandler, MockServer
+
+_RECORD = re.compile(r"^(?P<collection>/repositories/\d+/resources|/subjects|/agents/corporate_entities)(?:/(?P<id>\d+))?$")
+_BATCH_IMPORT = re.compile(r"^/repositories/\d+/batch_imports$")
+_LOGIN = re.compile(r"^/users/[^/]+/login$")
+_TEMP_URI = re.compile(r"^(?P<collection>.+)/import_\d+$")
+
+class AspaceServer(MockServer):
+    """Stand-in for the ArchivesSpace backend API used by the sync.
+
+    Resources, subjects and corporate agents are kept in memory as JSON text with
+    ArchivesSpace's lock_version semantics: an update must carry the stored lock_version
+    or it is answered with 409. ``conflict_rate`` of updates are answered as if someone
+    else had just edited the record.
+    """
+
+    def __init__(self, port: int, repo_id: str = "2", conflict_rate: float = 0.0, **kwargs):
+        super().__init__(port, AspaceHandler, **kwargs)
+        self.conflict_rate = conflict_rate
+        # collection → id → (system_mtime, record as JSON text)
+        self.collections: Dict[str, Dict[int, Tuple[float, str]]] = {
+            f"/repositories/{repo_id}/resources": {}, "/subjects": {}, "/agents/corporate_entities": {},
+        }
+        self.repo_id = repo_id
+        self._next_id = 1
+
+    def seed(self, existing: int, orphans: int) -> None:
+        """Pre-create stale copies of the first ``existing`` records, and ``orphans`` no longer in AtoM."""
+        path = f"/repositories/{self.repo_id}/resources"
+        for n in range(existing):
+            self.create(path, {"id_0": dataset.reference_code(n), "title": f"Old title {n}", "level": "series"})
+        for n in range(orphans):
+            self.create(path, {"id_0": f"GR-ORPHAN-{n:06d}", "title": f"Withdrawn series {n}", "level": "series"})
+
+    def create(self, collection: str, payload: Dict[str, Any]) -> Tuple[str, int]:
+        with self.lock:
+            rid = self._next_id
+            self._next_id += 1
+            uri = f"{collection}/{rid}"
+            self.collections[collection][rid] = self._store({**payload, "uri": uri, "lock_version": 0})
+        return uri, rid
+
+    def _store(self, record: Dict[str, Any]) -> Tuple[float, str]:
+        now = time.time()
+        return now, json.dumps({**record, "system_mtime": now})
+
+    def get(self, collection: str, rid: int) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            stored = self.collections[collection].get(rid)
+        return json.loads(stored[1]) if stored is not None else None
+
+    def update(self, collection: str, rid: int, payload: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        with self.lock:
+            if (entry := self.collections[collection].get(rid)) is None:
+                return 404, {"error": "Record not found"}
+            stored = json.loads(entry[1])
+            if self.random.random() < self.conflict_rate:
+                # Someone else saved the record first
+                stored["lock_version"] += 1
+                self.collections[collection][rid] = self._store(stored)
+            if payload.get("lock_version") != stored["lock_version"]:
+                return 409, {"error": {"lock_version": ["The record you tried to update has been modified since you fetched it."]}}
+            lock_version = stored["lock_version"] + 1
+            self.collections[collection][rid] = self._store({**payload, "uri": stored["uri"], "lock_version": lock_version})
+        return 200, {"status": "Updated", "id": rid, "lock_version": lock_version, "uri": stored["uri"], "warnings": []}
+
+    def delete(self, collection: str, rid: int) -> bool:
+        with self.lock:
+            return self.collections[collection].pop(rid, None) is not None
+
+    def page(self, collection: str, page: int, page_size: int, modified_since: float) -> Dict[str, Any]:
+        with self.lock:
+            texts = [text for mtime, text in self.collections[collection].values() if mtime >= modified_since]
+        last_page = max(1, -(-len(texts) // page_size))
+        return {
+            "first_page": 1, "last_page": last_page, "this_page": page, "total": len(texts),
+            "results": [json.loads(text) for text in texts[(page - 1) * page_size:page * page_size]],
+        }
+
+    def collection_of(self, uri: str) -> Tuple[Optional[str], Optional[int]]:
+        match = _RECORD.match(uri)
+        if not match or match["collection"] not in self.collections:
+            return None, None
+        return match["collection"], int(match["id"]) if match["id"] else None
+
+class AspaceHandler(MockHandler):
+    server: AspaceServer
+
+    def injects_errors(self, path: str) -> bool:
+        # A failed login only stops the run before it starts
+        return not _LOGIN.match(path)
+
+    def route(self, method, path, query, body):
+        server = self.server
+        if method == "POST" and _LOGIN.match(path):
+            return "login", 200, {"session": "bench-session"}, {}
+        if method == "POST" and _BATCH_IMPORT.match(path):
+            return "batch_imports", 200, self.batch_import(body or []), {}
+        if method == "POST" and path == "/batch_delete":
+            status, payload = self.batch_delete(query.get("record_uris[]", []))
+            return "batch_delete", status, payload, {}
+
+        collection, rid = server.collection_of(path)
+        if collection is None:
+            return "not found", 404, {"error": "Sinatra::NotFound"}, {}
+        route = collection.rsplit("/", 1)[-1] + ("/:id" if rid is not None else "")
+
+        if rid is None and method == "GET":
+            if "all_ids" in query:
+                with server.lock:
+                    return route, 200, list(server.collections[collection]), {}
+            page = int(query.get("page", ["1"])[0])
+            page_size = int(query.get("page_size", ["10"])[0])
+            modified_since = float(query.get("modified_since", ["0"])[0])
+            return route, 200, server.page(collection, page, page_size, modified_since), {}
+        if rid is None and method == "POST":
+            uri, new_id = server.create(collection, body or {})
+            return route, 200, {"status": "Created", "id": new_id, "lock_version": 0, "uri": uri, "warnings": []}, {}
+        if method == "GET":
+            record = server.get(collection, rid)
+            return (route, 200, record, {}) if record else (route, 404, {"error": "Record not found"}, {})
+        if method == "POST":
+            status, payload = server.update(collection, rid, body or {})
+            return route, status, payload, {}
+        if method == "DELETE":
+            if server.delete(collection, rid):
+                return route, 200, {"status": "Deleted", "id": rid}, {}
+            return route, 404, {"error": "Record not found"}, {}
+        return route, 405, {"error": "Method not allowed"}, {}
+
+    def batch_import(self, records) -> list:
+        saved = {}
+        for record in records:
+            match = _TEMP_URI.match(record.get("uri", ""))
+            if not match or match["collection"] not in self.server.collections:
+                return [{"errors": [f"Unsupported record URI: {record.get('uri')}"]}]
+            payload = {key: value for key, value in record.items() if key != "uri"}
+            saved[record["uri"]] = list(self.server.create(match["collection"], payload))
+        return [{"status": [{"type": "started"}]}, {"saved": saved}]
+
+    def batch_delete(self, uris) -> Tuple[int, Dict[str, Any]]:
+        targets = [self.server.collection_of(uri) for uri in uris]
+        if any(collection is None or self.server.get(collection, rid) is None for collection, rid in targets):
+            # ArchivesSpace rolls back the whole batch
+            return 400, {"error": "Record not found"}
+        for collection, rid in targets:
+            self.server.delete(collection, rid)
+        return 200, {"status": "Deleted"}
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve an in-memory ArchivesSpace backend API.")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--existing", type=int, default=0, help="stale resources to pre-create")
+    parser.add_argument("--orphans", type=int, default=0, help="resources no longer in AtoM")
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--conflict-rate", type=float, default=0)
+    args = parser.parse_args()
+    server = AspaceServer(args.port, conflict_rate=args.conflict_rate, latency=args.latency_ms / 1000, error_rate=args.error_rate)
+    server.seed(args.existing, args.orphans)
+    print(f"ArchivesSpace mock serving at {server.url}")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
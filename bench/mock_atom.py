@@ -0,0 +1,66 @@
+import argparse
+import hashlib
+import json
+import re
+from typing import Any, Dict, Tuple
+
+import dataset
+from mock_server import MockHandler, MockServer
+
+# Page size AtoM caps browse requests at
+MAX_PAGE_LIMIT = 100
+
+_DETAIL = re.compile(r"^/api/informationobjects/(?P<slug>bench-record-(?P<n>\d+))$")
+
+class AtomServer(MockServer):
+    """Stand-in for the AtoM REST API serving ``records`` synthetic information objects.
+
+    Records below ``changed`` are served at a new revision, for runs against a warm cache.
+    """
+
+    def __init__(self, port: int, records: int, changed: int = 0, **kwargs):
+        super().__init__(port, AtomHandler, **kwargs)
+        self.records = records
+        self.changed = changed
+
+    def detail(self, n: int) -> Tuple[Dict[str, Any], str]:
+        detail = dataset.atom_detail(n, revision=1 if n < self.changed else 0)
+        etag = '"%s"' % hashlib.md5(json.dumps(detail, sort_keys=True).encode()).hexdigest()
+        return detail, etag
+
+class AtomHandler(MockHandler):
+    server: AtomServer
+
+    def route(self, method, path, query, body):
+        if method == "GET" and path == "/api/informationobjects":
+            skip = int(query.get("skip", ["0"])[0])
+            limit = min(int(query.get("limit", ["10"])[0]), MAX_PAGE_LIMIT)
+            end = min(skip + limit, self.server.records)
+            results = [
+                {"slug": dataset.slug(n), "reference_code": dataset.reference_code(n)}
+                for n in range(skip, end)
+            ]
+            return "browse", 200, {"total": self.server.records, "results": results}, {}
+
+        match = _DETAIL.match(path)
+        if method == "GET" and match and int(match["n"]) < self.server.records:
+            detail, etag = self.server.detail(int(match["n"]))
+            if self.headers.get("If-None-Match") == etag:
+                return "detail", 304, None, {"ETag": etag}
+            return "detail", 200, detail, {"ETag": etag}
+        return "not found", 404, {"message": "Not found"}, {}
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve synthetic AtoM information objects.")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--records", type=int, default=1000)
+    parser.add_argument("--changed", type=int, default=0, help="records served at a new revision")
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    args = parser.parse_args()
+    server = AtomServer(args.port, args.records, args.changed, latency=args.latency_ms / 1000, error_rate=args.error_rate)
+    print(f"AtoM mock serving {args.records} records at {server.url}/api")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
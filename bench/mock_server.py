@@ -0,0 +1,98 @@
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+class MockServer(ThreadingHTTPServer):
+    """Threaded HTTP server with injected latency and errors, counting the requests it serves."""
+
+    daemon_threads = True
+
+    def __init__(self, port: int, handler, latency: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        super().__init__(("127.0.0.1", port), handler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests: Counter = Counter()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self) -> "MockServer":
+        threading.Thread(target=self.serve_forever, name=f"mock-{self.server_address[1]}", daemon=True).start()
+        return self
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {f"{method} {route}": count for (method, route), count in sorted(self.requests.items())}
+
+class MockHandler(BaseHTTPRequestHandler):
+    """Base handler: keep-alive, JSON bodies, and the server's latency and error injection.
+
+    Subclasses implement ``route(method, path, query, body)`` returning ``(route, status, body, headers)``.
+    """
+
+    # Keep-alive, so the client's connection pool behaves as it does against the real servers
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate writes; with Nagle on, each response waits for a delayed ACK
+    disable_nagle_algorithm = True
+    server: MockServer
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def injects_errors(self, path: str) -> bool:
+        return True
+
+    def route(self, method: str, path: str, query: Dict[str, list], body: Any) -> Tuple[str, int, Any, Dict[str, str]]:
+        raise NotImplementedError
+
+    def _handle(self, method: str) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        try:
+            body = json.loads(raw) if raw else None
+        except ValueError:
+            body = None
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+
+        server = self.server
+        with server.lock:
+            delay = server.latency * server.random.uniform(0.5, 1.5) if server.latency else 0.0
+            failed = server.random.random() < server.error_rate and self.injects_errors(parts.path)
+        if delay:
+            time.sleep(delay)
+        if failed:
+            route, status, payload, headers = "error", 503, {"error": "injected failure"}, {}
+        else:
+            route, status, payload, headers = self.route(method, parts.path, query, body)
+        with server.lock:
+            server.requests[method, route] += 1
+        self._send(status, payload, headers)
+
+    def _send(self, status: int, payload: Optional[Any], headers: Dict[str, str]) -> None:
+        data = json.dumps(payload).encode() if payload is not None else b""
+        self.send_response(status)
+        if payload is not None:
+            self.send_header("Content-Type", "application/json")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        self._handle("GET")
+
+    def do_POST(self) -> None:
+        self._handle("POST")
+
+    def do_DELETE(self) -> None:
+        self._handle("DELETE")
@@ -0,0 +1,143 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import dataset
+from mock_aspace import AspaceServer
+from mock_atom import AtomServer
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENTRY_POINTS = ("main", "csv_main")
+
+# Settings applied unless the calling environment sets them; everything else keeps the sync's defaults
+BENCH_DEFAULTS = {
+    "ATOM_REQUESTS_PER_SECOND": "1000",
+    "ATOM_RATE_BURST": "10",
+    "ATOM_RETRY_BASE_SECONDS": "0.1",
+    "ATOM_RETRY_MAX_SECONDS": "2",
+    "ATOM_BREAKER_RESET_SECONDS": "5",
+    "ATOM_SYNC_MODE": "full",
+}
+
+def prepare_workdir(entry: str, records: int) -> str:
+    """Copy src/ into a fresh directory, so state, caches and metrics of the run stay out of the tree."""
+    workdir = tempfile.mkdtemp(prefix=f"bench-{entry}-")
+    shutil.copytree(
+        os.path.join(REPO, "src"), os.path.join(workdir, "src"),
+        ignore=shutil.ignore_patterns("__pycache__", "*.sqlite", "state.journal*", "data.csv", "metrics.prom", "metrics_summary.json", "*.jsonl"),
+    )
+    shutil.copy(os.path.join(REPO, "atom.crt"), workdir)
+    if entry == "csv_main":
+        dataset.write_csv(os.path.join(workdir, "data.csv"), records)
+    return workdir
+
+def run_entry(entry: str, workdir: str, atom: AtomServer, aspace: AspaceServer, log_path: str) -> Dict[str, Any]:
+    """Run one sync as a subprocess and return its wall time, peak memory and metrics summary."""
+    summary_path = os.path.join(workdir, "metrics_summary.json")
+    env = {
+        **BENCH_DEFAULTS, **os.environ,
+        "ATOM_API_URL": f"{atom.url}/api",
+        "ATOM_API_TOKEN": "bench",
+        "ARCHIVESSPACE_URL": aspace.url,
+        "ARCHIVESSPACE_USER": "admin",
+        "ARCHIVESSPACE_PASS": "admin",
+        "REPOSITORY_ID": aspace.repo_id,
+        "CSV_PATHS": os.path.join(workdir, "data.csv"),
+        "METRICS_SUMMARY_PATH": summary_path,
+        "METRICS_PROM_PATH": os.path.join(workdir, "metrics.prom"),
+    }
+    before_atom, before_aspace = atom.stats(), aspace.stats()
+    started = time.monotonic()
+    with open(log_path, "a") as log:
+        proc = subprocess.Popen([sys.executable, os.path.join(workdir, "src", f"{entry}.py")],
+                                cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        # wait4 reports the resource usage of this child alone
+        _, status, usage = os.wait4(proc.pid, 0)
+    wall = time.monotonic() - started
+
+    summary: Dict[str, Any] = {}
+    if os.path.exists(summary_path):
+        with open(summary_path) as f:
+            summary = json.load(f)
+    records = summary.get("phases", {}).get("resources", {}).get("records", 0)
+    return {
+        "entry": entry,
+        "exit_code": os.waitstatus_to_exitcode(status),
+        "wall_seconds": round(wall, 3),
+        "records": records,
+        "records_per_second": round(records / wall, 2) if wall else 0.0,
+        "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),
+        "phases": {name: phase["seconds"] for name, phase in summary.get("phases", {}).items()},
+        "atom_requests": _delta(atom.stats(), before_atom),
+        "aspace_requests": _delta(aspace.stats(), before_aspace),
+        "writes": summary.get("writes", {}),
+    }
+
+def _delta(after: Dict[str, int], before: Dict[str, int]) -> Dict[str, int]:
+    return {key: count - before.get(key, 0) for key, count in after.items() if count - before.get(key, 0)}
+
+def print_results(results: List[Dict[str, Any]], baseline: Optional[List[Dict[str, Any]]]) -> None:
+    previous = {(r["entry"], r["run"]): r for r in baseline or []}
+    print(f"{'entry':<10} {'run':>3} {'records':>8} {'seconds':>9} {'rec/s':>9} {'peak MB':>8} {'AtoM req':>9} {'ASpace req':>10}  vs baseline")
+    for r in results:
+        base = previous.get((r["entry"], r["run"]))
+        change = f"{r['records_per_second'] / base['records_per_second']:.2f}x rec/s" if base and base["records_per_second"] else ""
+        print(f"{r['entry']:<10} {r['run']:>3} {r['records']:>8} {r['wall_seconds']:>9.1f} {r['records_per_second']:>9.1f} "
+              f"{r['peak_rss_mb']:>8.1f} {sum(r['atom_requests'].values()):>9} {sum(r['aspace_requests'].values()):>10}  {change}")
+        if r["exit_code"]:
+            print(f"  exited with {r['exit_code']}; see the log")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the sync entry points against local mock servers.")
+    parser.add_argument("--records", type=int, default=1000, help="AtoM records / CSV rows (1k to 100k)")
+    parser.add_argument("--entry", action="append", choices=ENTRY_POINTS, help="entry point to run (default: both)")
+    parser.add_argument("--runs", type=int, default=1, help="runs per entry point; later runs start from the state the previous one left")
+    parser.add_argument("--existing", type=float, default=0.5, help="share of records already in ArchivesSpace, as stale copies")
+    parser.add_argument("--orphans", type=float, default=0.01, help="resources in ArchivesSpace but no longer in the source, as a share of records")
+    parser.add_argument("--changed", type=float, default=0.0, help="share of AtoM records changed between runs")
+    parser.add_argument("--atom-latency-ms", type=float, default=20)
+    parser.add_argument("--aspace-latency-ms", type=float, default=30)
+    parser.add_argument("--atom-error-rate", type=float, default=0.0)
+    parser.add_argument("--aspace-error-rate", type=float, default=0.0)
+    parser.add_argument("--conflict-rate", type=float, default=0.0, help="share of updates answered with 409")
+    parser.add_argument("--output", default="bench_results.json", help="where to write the results")
+    parser.add_argument("--compare", help="results file of an earlier benchmark to compare with")
+    args = parser.parse_args()
+
+    results = []
+    log_path = os.path.abspath("bench_output.txt")
+    for entry in args.entry or ENTRY_POINTS:
+        # Every entry point starts from the same ArchivesSpace contents
+        atom = AtomServer(0, args.records, latency=args.atom_latency_ms / 1000, error_rate=args.atom_error_rate).start()
+        aspace = AspaceServer(0, conflict_rate=args.conflict_rate, latency=args.aspace_latency_ms / 1000,
+                              error_rate=args.aspace_error_rate).start()
+        aspace.seed(int(args.records * args.existing), int(args.records * args.orphans))
+        workdir = prepare_workdir(entry, args.records)
+        try:
+            for run in range(1, args.runs + 1):
+                if run > 1:
+                    atom.changed = int(args.records * args.changed)
+                result = run_entry(entry, workdir, atom, aspace, log_path)
+                results.append({"run": run, **result})
+        finally:
+            atom.shutdown()
+            aspace.shutdown()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+    with open(args.output, "w") as f:
+        json.dump({"settings": vars(args), "results": results}, f, indent=2)
+    print(f"Results written to {args.output}; sync logs in {log_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import os
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Comma-separated normalizations applied before terms are compared: "case", "whitespace", "punctuation"
+NORMALIZE = {
+    option.strip() for option in os.getenv("ACCESS_POINT_NORMALIZE", "whitespace").lower().split(",") if option.strip()
+}
+
+KINDS = ("subject", "place", "name")
+# Link roles per resource, in the order they are stored; creators are names in the "creator" role
+ROLES = ("subject", "place", "name", "creator")
+ROLE_KINDS = {"subject": "subject", "place": "place", "name": "name", "creator": "name"}
+
+_SPACES = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s.,;:]+$")
+
+def term_key(term: str, options: Iterable[str] = NORMALIZE) -> str:
+    """The form two terms are compared in; terms with the same key are the same access point."""
+    if "whitespace" in options:
+        term = _SPACES.sub(" ", term).strip()
+    if "punctuation" in options:
+        term = _TRAILING_PUNCTUATION.sub("", term)
+    if "case" in options:
+        term = term.casefold()
+    return term
+
+def stored_form(term: str) -> str:
+    """The form a term is kept and written in: as first seen, with runs of whitespace collapsed."""
+    return _SPACES.sub(" ", term).strip()
+
+class AccessPointRegistry:
+    """Interned access-point terms and the terms each resource links to, by integer id.
+
+    Every distinct term is stored once, in the form it was first seen, and resources keep
+    tuples of term ids per role. Adding a record costs time in its own terms only, so
+    memory and CPU grow linearly with the run.
+    """
+
+    def __init__(self):
+        self._terms: List[Tuple[str, str]] = []            # id → (kind, term)
+        self._ids: Dict[Tuple[str, str], int] = {}         # (kind, key) → id
+        self._links: Dict[str, Tuple[Tuple[int, ...], ...]] = {}
+
+    def __len__(self) -> int:
+        return len(self._links)
+
+    def __contains__(self, id_0: str) -> bool:
+        return id_0 in self._links
+
+    def intern(self, kind: str, term: str, new_terms: Optional[List[List[Any]]] = None) -> Optional[int]:
+        """Return the id of ``term``, adding it (and appending it to ``new_terms``) when unseen."""
+        if not term or not (key := term_key(term)):
+            return None
+        if (tid := self._ids.get((kind, key))) is None:
+            tid = self._ids[kind, key] = len(self._terms)
+            term = stored_form(term)
+            self._terms.append((kind, term))
+            if new_terms is not None:
+                new_terms.append([tid, kind, term])
+        return tid
+
+    def add(self, id_0: str, terms: Dict[str, Iterable[str]]) -> Tuple[List[List[int]], List[List[Any]]]:
+        """Link ``id_0`` to its terms per role; return the stored id lists and the newly interned terms."""
+        new_terms: List[List[Any]] = []
+        links = []
+        for role in ROLES:
+            ids = []
+            for term in terms.get(role, ()):
+                if (tid := self.intern(ROLE_KINDS[role], term, new_terms)) is not None and tid not in ids:
+                    ids.append(tid)
+            links.append(ids)
+        self._links[id_0] = tuple(tuple(ids) for ids in links)
+        return links, new_terms
+
+    def restore(self, id_0: str, links: List[List[int]], new_terms: Iterable[List[Any]] = ()) -> None:
+        """Replay a journaled record whose terms were interned with the ids in ``new_terms``."""
+        for tid, kind, term in new_terms:
+            if tid == len(self._terms):
+                self._terms.append((kind, term))
+                self._ids.setdefault((kind, term_key(term)), tid)
+        self._links[id_0] = tuple(tuple(ids) for ids in links)
+
+    def terms(self, kind: str) -> Iterator[str]:
+        """Every distinct term of ``kind``, in the order first seen."""
+        return (term for term_kind, term in self._terms if term_kind == kind)
+
+    def resource_ids(self) -> Iterable[str]:
+        return self._links.keys()
+
+    def records(self) -> Iterator[Tuple[str, Dict[str, List[str]]]]:
+        """Yield ``(id_0, {role: [term, ...]})`` for every resource."""
+        for id_0, links in list(self._links.items()):
+            yield id_0, {role: [self._terms[tid][1] for tid in ids] for role, ids in zip(ROLES, links)}
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "terms": [list(entry) for entry in self._terms],
+            "links": {id_0: [list(ids) for ids in links] for id_0, links in self._links.items()},
+        }
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "AccessPointRegistry":
+        registry = cls()
+        if "terms" in data and "links" in data:
+            registry.restore_all(data["terms"], data["links"])
+        else:
+            # state.json written before the registry kept each resource's raw term lists
+            for id_0, points in data.items():
+                registry.add(id_0, {
+                    **points,
+                    "creator": [
+                        creator.get("authotized_form_of_name") if isinstance(creator, dict) else creator
+                        for creator in points.get("creator", [])
+                    ],
+                })
+        return registry
+
+    def restore_all(self, terms: List[List[str]], links: Dict[str, List[List[int]]]) -> None:
+        for kind, term in terms:
+            self._ids.setdefault((kind, term_key(term)), len(self._terms))
+            self._terms.append((kind, term))
+        for id_0, ids in links.items():
+            self._links[id_0] = tuple(tuple(role_ids) for role_ids in ids)
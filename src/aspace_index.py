@@ -0,0 +1,110 @@
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+from index_store import IndexStore
+
+class IndexEntry:
+    """Compact index record for one ArchivesSpace object."""
+
+    __slots__ = ("key", "id", "uri", "lock_version")
+
+    def __init__(self, key: str, rid: int, uri: str, lock_version: int):
+        self.key = key
+        self.id = rid
+        self.uri = uri
+        self.lock_version = lock_version
+
+    def __repr__(self) -> str:
+        return f"IndexEntry({self.key!r}, {self.id}, {self.uri!r}, {self.lock_version})"
+
+class Namespace:
+    """Entries of a single record kind, looked up by identifier or by URI.
+
+    Changes made through ``add``, ``remember`` and ``remove`` are written through to the
+    persistent store so the index survives crashes. Full records live only in the store and
+    are read back with ``record``, which keeps the in-memory entries small.
+    """
+
+    def __init__(self, kind: str, store: Optional[IndexStore] = None):
+        self.kind = kind
+        self._store = store
+        self._by_key: Dict[str, IndexEntry] = {}
+        self._by_uri: Dict[str, IndexEntry] = {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._by_key
+
+    def __getitem__(self, key: str) -> IndexEntry:
+        return self._by_key[key]
+
+    def __iter__(self) -> Iterator[IndexEntry]:
+        return iter(list(self._by_key.values()))
+
+    def __len__(self) -> int:
+        return len(self._by_key)
+
+    def get(self, key: str) -> Optional[IndexEntry]:
+        return self._by_key.get(key)
+
+    def by_uri(self, uri: str) -> Optional[IndexEntry]:
+        return self._by_uri.get(uri)
+
+    def keys(self):
+        return self._by_key.keys()
+
+    def load(self, rows: Iterable[Tuple[str, Tuple[int, str, int]]]) -> None:
+        """Fill the namespace from stored rows without writing back to the store."""
+        for key, (rid, uri, lock_version) in rows:
+            self._insert(IndexEntry(key, rid, uri, lock_version))
+
+    def add(self, key: str, rid: int, uri: str, lock_version: int,
+            record: Optional[Dict[str, Any]] = None) -> IndexEntry:
+        entry = self._insert(IndexEntry(key, rid, uri, lock_version))
+        if self._store:
+            self._store.put(self.kind, key, rid, uri, lock_version, record)
+        return entry
+
+    def record(self, entry: IndexEntry) -> Optional[Dict[str, Any]]:
+        """Last known full record for ``entry``, or None when it has to be fetched."""
+        return self._store.record(entry.uri) if self._store else None
+
+    def remember(self, entry: IndexEntry, lock_version: int, record: Optional[Dict[str, Any]]) -> None:
+        """Record the lock_version and full record ArchivesSpace now holds for ``entry``."""
+        entry.lock_version = lock_version
+        if self._store:
+            self._store.set_record(entry.uri, lock_version, record)
+
+    def remove(self, entry: IndexEntry) -> None:
+        if self._by_key.get(entry.key) is entry:
+            del self._by_key[entry.key]
+        self._by_uri.pop(entry.uri, None)
+        if self._store:
+            self._store.remove(entry.uri)
+
+    def _insert(self, entry: IndexEntry) -> IndexEntry:
+        # Replace whatever was indexed under the same identifier or the same URI
+        for stale in (self._by_key.get(entry.key), self._by_uri.get(entry.uri)):
+            if stale is not None:
+                self._by_key.pop(stale.key, None)
+                self._by_uri.pop(stale.uri, None)
+        self._by_key[entry.key] = entry
+        self._by_uri[entry.uri] = entry
+        return entry
+
+class ArchivesSpaceIndex:
+    """Resources, subjects and corporate agents, each in its own namespace."""
+
+    __slots__ = ("resources", "subjects", "agents")
+
+    def __init__(self, store: Optional[IndexStore] = None):
+        self.resources = Namespace("resources", store)
+        self.subjects = Namespace("subjects", store)
+        self.agents = Namespace("agents", store)
+
+    def namespaces(self) -> Tuple[Namespace, Namespace, Namespace]:
+        return self.resources, self.subjects, self.agents
+
+    def by_uri(self, uri: str) -> Optional[IndexEntry]:
+        for namespace in self.namespaces():
+            if (entry := namespace.by_uri(uri)) is not None:
+                return entry
+        return None
@@ -1,50 +1,178 @@
 import os
-import time
 import json
 import logging
 import ssl
+import queue
+import threading
 import requests
+from typing import Any, Dict, Iterator, NamedTuple, Optional, Tuple
+
+from detail_cache import CACHE_PATH, DetailCache, content_hash
+from http_session import new_session
+from rate_limiter import TokenBucket
+from retry        import CircuitBreaker, CircuitOpenError, RetryMetrics, RetryPolicy
 
 ATOM_API_TOKEN = os.environ["ATOM_API_TOKEN"]
 HEADERS = {"REST-API-KEY": ATOM_API_TOKEN}
 BASE = os.getenv("ATOM_API_URL", "https://search-bcarchives.royalbcmuseum.bc.ca/api").rstrip("/")
 QUERY = os.getenv("ATOM_INFORMATION_OBJECTS_QUERY", "sq0=GR*&sf0=referenceCode&levels=197")
+# Browse filter used by incremental runs to request records updated on or after a date
+UPDATED_SINCE_PARAM = os.getenv("ATOM_UPDATED_SINCE_PARAM", "lastUpdated")
 
-# Create an SSL context using the provided atom.crt file
-ssl_context = ssl.create_default_context()
+# Create an SSL context that trusts only the provided atom.crt file
+ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
 cert_path = os.path.join(os.path.dirname(__file__), "..", "atom.crt")
 ssl_context.load_verify_locations(cert_path)
 
-# 24 hours (288 attempts at 5 minutes each)
-MAX_RETRIES = 288
+# Shared keep-alive session; the SSL context above is loaded once and reused by every connection
+session = new_session("atom", ssl_context=ssl_context, headers=HEADERS)
+
+# Retry policy: 4xx responses fail fast, 5xx responses and timeouts back off exponentially with jitter
+MAX_ATTEMPTS          = int(os.getenv("ATOM_MAX_ATTEMPTS", "8"))
+RETRY_BASE_SECONDS    = float(os.getenv("ATOM_RETRY_BASE_SECONDS", "2"))
+RETRY_MAX_SECONDS     = float(os.getenv("ATOM_RETRY_MAX_SECONDS", "300"))
+REQUEST_TIMEOUT       = float(os.getenv("ATOM_REQUEST_TIMEOUT", "60"))
+# Circuit breaker: pause all AtoM traffic after consecutive failures and probe until it recovers
+BREAKER_THRESHOLD     = int(os.getenv("ATOM_BREAKER_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("ATOM_BREAKER_RESET_SECONDS", "300"))
+BREAKER_MAX_OPEN_SECONDS = float(os.getenv("ATOM_BREAKER_MAX_OPEN_SECONDS", str(24 * 3600)))
+
+retry_metrics = RetryMetrics()
+breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_RESET_SECONDS, BREAKER_MAX_OPEN_SECONDS, retry_metrics, "AtoM")
+retry_policy = RetryPolicy(MAX_ATTEMPTS, RETRY_BASE_SECONDS, RETRY_MAX_SECONDS, REQUEST_TIMEOUT, breaker)
+
+# Throughput allowed against the AtoM server
+REQUESTS_PER_SECOND = float(os.getenv("ATOM_REQUESTS_PER_SECOND", "1"))
+RATE_BURST          = int(os.getenv("ATOM_RATE_BURST", "1"))
+MAX_IN_FLIGHT       = int(os.getenv("ATOM_MAX_IN_FLIGHT", "4"))
+# Number of browse pages fetched ahead of the page being processed
+PREFETCH_PAGES      = int(os.getenv("ATOM_PREFETCH_PAGES", "2"))
+
+rate_limiter = TokenBucket(REQUESTS_PER_SECOND, RATE_BURST)
+
+# Persistent detail cache; set ATOM_CACHE_PATH to an empty string to disable it
+detail_cache = DetailCache(CACHE_PATH) if CACHE_PATH else None
 
-def fetch_atom_detail(slug: str) -> dict:
+# Detail responses meaning the record no longer exists in AtoM
+GONE_STATUSES = (404, 410)
+
+class AtomDetail(NamedTuple):
+    detail: Dict[str, Any]
+    changed: bool
+    content_hash: Optional[str] = None
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    # Set when the detail could not be fetched, as opposed to a record AtoM no longer returns
+    failed: bool = False
+
+def fetch_atom_detail(slug: str) -> AtomDetail:
+    """Fetch a detail record, revalidating against the local cache when an entry exists."""
     url = f"{BASE}/informationobjects/{slug}"
-    attempts = 0
-    while attempts < MAX_RETRIES:
-        try:
-            response = requests.get(url, headers=HEADERS, verify=cert_path)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            attempts += 1
-            logging.error("Attempt %d: Failed to fetch details for slug '%s': %s", attempts, slug, e)
-            if attempts < MAX_RETRIES:
-                time.sleep(300)  # Pause for 5 minutes before retrying
-    return {}  # Return an empty dictionary after MAX_RETRIES failed attempts
-
-def fetch_slugs(skip: int, limit: int):
+    cached = detail_cache.get(slug) if detail_cache else None
+    headers = {}
+    if cached and cached.etag:
+        headers["If-None-Match"] = cached.etag
+    if cached and cached.last_modified:
+        headers["If-Modified-Since"] = cached.last_modified
+
+    def attempt() -> AtomDetail:
+        rate_limiter.acquire()
+        response = session.get(url, headers=headers, timeout=retry_policy.timeout)
+        if response.status_code == 304 and cached:
+            return AtomDetail(cached.payload, False, cached.content_hash, cached.etag, cached.last_modified)
+        response.raise_for_status()
+        detail = response.json()
+        digest = content_hash(detail)
+        return AtomDetail(
+            detail,
+            cached is None or cached.content_hash != digest,
+            digest,
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+        )
+
+    try:
+        return retry_policy.call(attempt, f"AtoM detail '{slug}'")
+    except requests.exceptions.HTTPError as e:
+        # Failures are logged by the retry policy. A record AtoM reports as gone is simply not
+        # processed; any other error means it was not seen, and callers must not treat it as gone
+        return AtomDetail({}, True, failed=e.response is None or e.response.status_code not in GONE_STATUSES)
+    except (requests.exceptions.RequestException, CircuitOpenError):
+        return AtomDetail({}, True, failed=True)
+
+def remember_detail(slug: str, fetched: AtomDetail) -> None:
+    """Store a detail in the cache once it has been written to ArchivesSpace."""
+    if detail_cache and fetched.detail and fetched.content_hash:
+        detail_cache.put(slug, fetched.detail, fetched.content_hash, fetched.etag, fetched.last_modified)
+
+def log_retry_metrics() -> None:
+    counts = retry_metrics.snapshot()
+    if counts:
+        logging.info("AtoM retries: %s", ", ".join(f"{k}={v:g}" for k, v in sorted(counts.items())))
+
+def evict_expired_details() -> None:
+    if detail_cache:
+        evicted = detail_cache.evict_expired()
+        if evicted:
+            logging.info("Evicted %s expired AtoM detail cache entries.", evicted)
+
+def fetch_slugs(skip: int, limit: int, updated_since: Optional[str] = None):
     url = f"{BASE}/informationobjects?{QUERY}&limit={limit}&skip={skip}"
-    attempts = 0
-    while attempts < MAX_RETRIES:
+    if updated_since:
+        # The filter takes a date, so records updated on the watermark day are fetched again
+        url += f"&{UPDATED_SINCE_PARAM}={updated_since[:10]}"
+    def attempt():
+        rate_limiter.acquire()
+        response = session.get(url, timeout=retry_policy.timeout)
+        response.raise_for_status()
+        data = response.json()
+        return data["results"], data.get("total", 0)  # total defaults to 0 if not provided
+
+    # Failures propagate so an incomplete listing is never mistaken for the end of the result set
+    return retry_policy.call(attempt, f"AtoM browse page at skip {skip}")
+
+def prefetch_slug_pages(skip: int, limit: int, updated_since: Optional[str] = None,
+                        prefetch: int = PREFETCH_PAGES) -> Iterator[Tuple[int, list, int]]:
+    """Yield ``(skip, results, total)`` browse pages read ahead by a background producer.
+
+    Up to ``prefetch`` pages are buffered, so page requests overlap with record processing.
+    The producer stops after the final short (or empty) page of the result set.
+    """
+    pages: queue.Queue = queue.Queue(maxsize=max(1, prefetch))
+    stop = threading.Event()
+    done = object()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        offset = skip
         try:
-            response = requests.get(url, headers=HEADERS, verify=cert_path)
-            response.raise_for_status()
-            data = response.json()
-            return data["results"], data.get("total", 0)  # total defaults to 0 if not provided
-        except requests.exceptions.RequestException as e:
-            attempts += 1
-            logging.error("Attempt %d: Failed to fetch slugs: %s", attempts, e)
-            if attempts < MAX_RETRIES:
-                time.sleep(300)  # Pause for 5 minutes before retrying
-    return [], 0  # Return empty results and total 0 after MAX_RETRIES failed attempts
+            while not stop.is_set():
+                results, total = fetch_slugs(offset, limit, updated_since)
+                if not put((offset, results, total)):
+                    break
+                # A short page that reaches the reported total is the last one; the server
+                # may also cap the page size, so a short page alone is not enough
+                if not results or (len(results) < limit and offset + len(results) >= total):
+                    break
+                offset += len(results)
+        except Exception as e:
+            logging.error("Page producer stopped at skip %s: %s", offset, e)
+        finally:
+            put(done)
+
+    producer = threading.Thread(target=produce, name="atom-pages", daemon=True)
+    producer.start()
+    try:
+        while (page := pages.get()) is not done:
+            yield page
+    finally:
+        # The daemon producer notices this after its current request and exits
+        stop.set()
@@ -0,0 +1,97 @@
+import logging
+import os
+import threading
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import requests
+
+from access_points import stored_form, term_key
+from aspace_index import ArchivesSpaceIndex, IndexEntry, Namespace
+from updater import create_corporate_agent, create_subject
+
+# "inline" writes each resource once with its subject/agent links already in the payload;
+# "deferred" keeps the separate linking pass after all resources are written
+LINK_MODE = os.getenv("ASPACE_LINK_MODE", "deferred").lower()
+
+class ResolvedLinks(NamedTuple):
+    subjects: List[Dict[str, Any]]
+    linked_agents: List[Dict[str, Any]]
+    # Terms whose authority could not be found or created; their links are missing
+    unresolved: List[str]
+
+class AuthorityResolver:
+    """Resolves access-point terms to ArchivesSpace URIs, creating missing authorities on demand.
+
+    Terms are compared after the ACCESS_POINT_NORMALIZE normalizations, as the access point
+    registry does, and every variant resolves to the authority of the first form seen. Each
+    term has its own lock, so concurrent callers resolving the same new term create it once.
+    Authorities are created immediately, never queued for a batch import, because the URI is
+    needed straight away.
+    """
+
+    def __init__(self, index: ArchivesSpaceIndex):
+        self.index = index
+        self._guard = threading.Lock()
+        self._locks: Dict[Tuple[str, str], threading.Lock] = {}
+        # (namespace kind, normalized term) → the form authorities are looked up and created in
+        self._forms: Dict[Tuple[str, str], str] = {}
+
+    def _form(self, namespace: Namespace, term: str) -> Optional[str]:
+        if not term or not (key := term_key(term)):
+            return None
+        with self._guard:
+            return self._forms.setdefault((namespace.kind, key), stored_form(term))
+
+    def _lock_for(self, namespace: Namespace, term: str) -> threading.Lock:
+        with self._guard:
+            return self._locks.setdefault((namespace.kind, term), threading.Lock())
+
+    def _resolve(self, namespace: Namespace, term: str, create) -> Optional[IndexEntry]:
+        if (entry := namespace.get(term)) is not None:
+            return entry
+        with self._lock_for(namespace, term):
+            # Another caller may have created it while this one waited
+            if (entry := namespace.get(term)) is None:
+                try:
+                    create()
+                except requests.exceptions.RequestException as e:
+                    logging.error("✖ Create failed for %s %s: %s", namespace.kind, term, e)
+                entry = namespace.get(term)
+        return entry
+
+    def subject(self, term: str, term_type: str) -> Optional[IndexEntry]:
+        subjects = self.index.subjects
+        if (term := self._form(subjects, term)) is None:
+            return None
+        return self._resolve(subjects, term, lambda: create_subject(
+            {"source": "local", "term_type": term_type, "id_0": term}, subjects, defer=False))
+
+    def agent(self, name: str) -> Optional[IndexEntry]:
+        agents = self.index.agents
+        if (name := self._form(agents, name)) is None:
+            return None
+        return self._resolve(agents, name, lambda: create_corporate_agent({"id_0": name}, agents, defer=False))
+
+    def links(self, subjects: Iterable[str], places: Iterable[str], names: Iterable[str],
+              creators: Iterable[str]) -> ResolvedLinks:
+        """Return the ``subjects`` and ``linked_agents`` lists for a resource payload, and the terms left unresolved."""
+        unresolved: List[str] = []
+
+        def resolved(term: str, entry: Optional[IndexEntry]) -> Optional[IndexEntry]:
+            if entry is None and term and term_key(term):
+                unresolved.append(term)
+            return entry
+
+        linked_subjects = [
+            {"ref": entry.uri} for term in subjects if (entry := resolved(term, self.subject(term, "topical")))
+        ] + [
+            {"ref": entry.uri} for term in places if (entry := resolved(term, self.subject(term, "geographic")))
+        ]
+        linked_agents = [
+            {"ref": entry.uri, "role": "subject"} for name in names if (entry := resolved(name, self.agent(name)))
+        ]
+        # Only the first creator gets the "creator" role; the rest are linked as subjects
+        for idx, name in enumerate(creators):
+            if (entry := resolved(name, self.agent(name))):
+                linked_agents.append({"ref": entry.uri, "role": "creator" if idx == 0 else "subject"})
+        return ResolvedLinks(linked_subjects, linked_agents, unresolved)
@@ -0,0 +1,141 @@
+import logging
+import requests
+from typing import Any, Dict, List
+
+from access_points import AccessPointRegistry
+from aspace_index import ArchivesSpaceIndex
+from profiling import span
+from state_manager import is_done, mark_done, save_state
+from updater import (
+    BULK_CREATE_SIZE, create_corporate_agent, create_subject, flush_bulk_creates, update_corporate_agent,
+    update_resource, update_subject, write_stats,
+)
+
+def request_error(e: requests.exceptions.RequestException) -> str:
+    """``e`` with the response body, if any; connection errors and timeouts have no response."""
+    if e.response is None:
+        return str(e)
+    return f"{e} ({e.response.text})"
+
+def finish_item(state, key: str) -> None:
+    """Mark an item of the current phase done and checkpoint it, so a restart skips it.
+
+    With batch imports the item may still be queued, so it is only journaled by the
+    checkpoint that follows the flush.
+    """
+    mark_done(state, key)
+    if not BULK_CREATE_SIZE:
+        save_state(state)
+
+def subject_term_types(registry: AccessPointRegistry) -> Dict[str, str]:
+    """Term type for every subject-namespace term collected in ``registry``.
+
+    Subjects and places share the subject namespace; a term used as both is kept as a
+    place, so it is written once rather than flipping its term type on every run.
+    """
+    term_types = {subject: "topical" for subject in registry.terms("subject")}
+    term_types.update((place, "geographic") for place in registry.terms("place"))
+    return term_types
+
+@span("authorities")
+def process_authorities(state, index: ArchivesSpaceIndex):
+    """Authority phase: create missing subjects and agents, and correct existing ones only where they differ.
+
+    Created, updated and unchanged counts are logged at the end of the phase.
+    """
+    registry = state["access_points"]
+    before = write_stats.copy()
+
+    for term, term_type in subject_term_types(registry).items():
+        if is_done(state, f"subject:{term}"):
+            continue
+        label = "place" if term_type == "geographic" else "subject"
+        subject_data = {
+            "source": "local",
+            "term_type": term_type,
+            "id_0": term,
+        }
+        try:
+            if term in index.subjects:
+                # Only source and term type are tracked; a matching subject is skipped
+                update_subject(subject_data, index.subjects[term], index.subjects)
+            else:
+                logging.info("Creating new %s: %s", label, term)
+                create_subject(subject_data, index.subjects)
+        except requests.exceptions.RequestException as e:
+            logging.error("✖ Create/Update failed for %s %s: %s", label, term, request_error(e))
+        finish_item(state, f"subject:{term}")
+
+    # Process unique names
+    for name in registry.terms("name"):
+        if is_done(state, f"name:{name}"):
+            continue
+        agent_data = {
+            "id_0": name,
+        }
+        try:
+            if name in index.agents:
+                update_corporate_agent(agent_data, index.agents[name], index.agents)
+            else:
+                logging.info("Creating new corporate agent: %s", name)
+                create_corporate_agent(agent_data, index.agents)
+        except requests.exceptions.RequestException as e:
+            logging.error("✖ Create/Update failed for corporate agent %s: %s", name, request_error(e))
+        finish_item(state, f"name:{name}")
+
+    # Queued subjects and agents need their URIs before resources can link to them
+    flush_bulk_creates()
+    save_state(state)
+
+    for kind in ("subject", "corporate agent"):
+        logging.info(
+            "Authority sync for %ss: %s created, %s updated, %s unchanged", kind,
+            *(write_stats[kind, outcome] - before[kind, outcome] for outcome in ("created", "updated", "skipped")),
+        )
+
+def resource_links(resource_id: str, access_points: Dict[str, List[str]], index: ArchivesSpaceIndex) -> Dict[str, Any]:
+    """The ``subjects`` and ``linked_agents`` update for a resource, from the authorities already indexed."""
+    linked_subjects = [
+        {"ref": index.subjects[sub].uri} for sub in access_points.get("subject", []) if sub in index.subjects
+    ]
+    linked_places = [
+        {"ref": index.subjects[place].uri} for place in access_points.get("place", []) if place in index.subjects
+    ]
+    linked_agents = [
+        {"ref": index.agents[name].uri, "role": "subject"} for name in access_points.get("name", []) if name in index.agents
+    ]
+
+    # Add creators with role "subject" and only the first creator with role "creator"
+    linked_creators = []
+    for idx, creator_id in enumerate(access_points.get("creator", [])):
+        if creator_id in index.agents:
+            if idx == 0:  # Add only the first creator with role "creator"
+                linked_creators.append({"ref": index.agents[creator_id].uri, "role": "creator"})
+            else:
+                linked_creators.append({"ref": index.agents[creator_id].uri, "role": "subject"})
+
+    # Update only the necessary fields while preserving existing properties
+    return {
+        "id_0": resource_id,
+        "subjects": linked_subjects + linked_places,
+        "linked_agents": linked_agents + linked_creators,
+    }
+
+@span("linking")
+def link_resources(state, index: ArchivesSpaceIndex):
+    """Linking phase: rewrite each synced resource with its subject and agent links."""
+    for resource_id, access_points in state["access_points"].records():
+        if is_done(state, resource_id):
+            continue
+        resource_entry = index.resources.get(resource_id)
+        if not resource_entry:
+            logging.warning("Resource ID %s not found in the index. Skipping.", resource_id)
+            finish_item(state, resource_id)
+            continue
+
+        try:
+            logging.info("Updating resource %s with linked subjects and agents.", resource_id)
+            update_resource(resource_links(resource_id, access_points, index), resource_entry, index.resources)
+        except requests.exceptions.RequestException as e:
+            logging.error("✖ Update failed for resource %s: %s", resource_id, request_error(e))
+        finish_item(state, resource_id)
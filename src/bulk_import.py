@@ -0,0 +1,109 @@
+import logging
+import threading
+import requests
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from aspace_index import Namespace
+
+# jsonmodel_type expected by the batch importer for each record kind
+JSONMODEL_TYPES = {
+    "resource": "resource",
+    "subject": "subject",
+    "corporate agent": "agent_corporate_entity",
+}
+
+# (kind, ident, payload, namespace, on_created)
+Pending = Tuple[str, str, Dict[str, Any], Namespace, Optional[Callable[[], None]]]
+
+class BulkCreator:
+    """Collects new records and creates them through ``/repositories/:repo_id/batch_imports``.
+
+    Each record is sent with a temporary ``import_N`` URI; the importer answers with the real
+    URI for each one, which ``record_created`` maps back into the index. A batch is imported
+    in a single transaction, so when it fails every record in it falls back to ``create_one``.
+    """
+
+    def __init__(self, client, repo_id: str, batch_size: int, create_paths: Dict[str, str],
+                 create_one: Callable[[str, str, Dict[str, Any], Namespace], bool],
+                 record_created: Callable[[str, str, Dict[str, Any], Namespace, str, int], None]):
+        self.client = client
+        self.repo_id = repo_id
+        self.batch_size = max(1, batch_size)
+        self.create_paths = create_paths
+        self.create_one = create_one
+        self.record_created = record_created
+        self._pending: List[Pending] = []
+        self._keys = set()
+        # Writers on several threads share the queue; a flush holds it until the batch is created
+        self._lock = threading.RLock()
+
+    def is_pending(self, kind: str, ident: str) -> bool:
+        with self._lock:
+            return (kind, ident) in self._keys
+
+    def add(self, kind: str, ident: str, payload: Dict[str, Any], namespace: Namespace,
+            on_created: Optional[Callable[[], None]] = None) -> None:
+        with self._lock:
+            self._pending.append((kind, ident, payload, namespace, on_created))
+            self._keys.add((kind, ident))
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._pending:
+                self._flush()
+
+    def _flush(self) -> None:
+        batch, self._pending, self._keys = self._pending, [], set()
+
+        records = []
+        for n, (kind, ident, payload, _, _) in enumerate(batch):
+            records.append({
+                **payload,
+                "jsonmodel_type": payload.get("jsonmodel_type", JSONMODEL_TYPES[kind]),
+                "uri": f"{self.create_paths[kind]}/import_{n}",
+            })
+
+        saved = self._import(records)
+        for n, (kind, ident, payload, namespace, on_created) in enumerate(batch):
+            created = saved.get(records[n]["uri"]) if saved else None
+            if created:
+                uri, rid = created
+                self.record_created(kind, ident, payload, namespace, uri, rid)
+                ok = True
+            else:
+                ok = self.create_one(kind, ident, payload, namespace)
+            if ok and on_created:
+                on_created()
+
+    def _import(self, records: List[Dict[str, Any]]) -> Optional[Dict[str, Tuple[str, int]]]:
+        """Run one batch import and return temporary URI → (uri, id), or None if it failed."""
+        logging.info("Importing a batch of %s new records", len(records))
+        try:
+            resp = self.client.post(f"/repositories/{self.repo_id}/batch_imports", json=records)
+        except requests.exceptions.RequestException as e:
+            logging.error("✖ Batch import request failed, creating records one at a time: %s", e)
+            return None
+        try:
+            messages = resp.json()
+        except ValueError:
+            messages = []
+        if isinstance(messages, dict):
+            messages = [messages]
+
+        for message in messages:
+            if isinstance(message, dict) and message.get("errors"):
+                logging.error("✖ Batch import failed, creating records one at a time: %s", message["errors"])
+                return None
+        for message in messages:
+            if isinstance(message, dict) and "saved" in message:
+                saved = {}
+                for temp_uri, created in message["saved"].items():
+                    # Depending on the version this is either the URI or a [uri, id] pair
+                    uri = created[0] if isinstance(created, list) else created
+                    saved[temp_uri] = (uri, int(uri.rsplit("/", 1)[-1]))
+                return saved
+
+        logging.error("✖ Batch import returned no saved records (HTTP %s), creating records one at a time", resp.status_code)
+        return None
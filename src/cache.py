@@ -1,51 +1,83 @@
 import os
-from typing import Dict, Any
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, Iterator, Optional
 from asnake.client import ASnakeClient
 
+from aspace_index import ArchivesSpaceIndex, Namespace
+from http_session import mount_pool
+from index_store  import INDEX_PATH, IndexStore
+
 REPO_ID = os.getenv("REPOSITORY_ID", "2")
+# Records per list page (ArchivesSpace caps this at its max_page_size, 250 by default)
+PAGE_SIZE = int(os.getenv("ASPACE_PAGE_SIZE", "250"))
+# Concurrent page requests while loading the index
+LOAD_WORKERS = int(os.getenv("ASPACE_LOAD_WORKERS", "4"))
+# Overlap applied to modified_since so clock skew between hosts cannot hide an edit
+REFRESH_OVERLAP_SECONDS = 300
 
 client = ASnakeClient(
     baseurl=os.environ["ARCHIVESSPACE_URL"],
     username=os.environ["ARCHIVESSPACE_USER"],
     password=os.environ["ARCHIVESSPACE_PASS"],
 )
+mount_pool("archivesspace", client.session)
 client.authorize()
 
-def load_existing_resources() -> Dict[str, Dict[str, Any]]:
-    ids = client.get(f"/repositories/{REPO_ID}/resources", params={"all_ids": True}).json()
-    found: Dict[str, Dict[str, Any]] = {}
-    for rid in ids:
-        rec = client.get(f"/repositories/{REPO_ID}/resources/{rid}").json()
-        if (id0 := rec.get("id_0")):
-            found[id0] = {
-                "rid": rid,
-                "uri": rec["uri"],
-                "lock_ver": rec["lock_version"],
-            }
-    return found
-
-def load_existing_subjects() -> Dict[str, Dict[str, Any]]:
-    ids = client.get("/subjects", params={"all_ids": True}).json()
-    found: Dict[str, Dict[str, Any]] = {}
-    for sid in ids:
-        rec = client.get(f"/subjects/{sid}").json()
-        if (id0 := rec.get("terms", [{}])[0].get("term")):
-            found[id0] = {
-                "sid": sid,
-                "uri": rec["uri"],
-                "lock_ver": rec["lock_version"],
-            }
-    return found
-
-def load_existing_agents() -> Dict[str, Dict[str, Any]]:
-    ids = client.get("/agents/corporate_entities", params={"all_ids": True}).json()
-    found: Dict[str, Dict[str, Any]] = {}
-    for aid in ids:
-        rec = client.get(f"/agents/corporate_entities/{aid}").json()
-        if (id0 := rec.get("names", [{}])[0].get("primary_name")):
-            found[id0] = {
-                "aid": aid,
-                "uri": rec["uri"],
-                "lock_ver": rec["lock_version"],
-            }
-    return found
+# Persistent copy of the index; updater writes through to it after every create, update and delete
+index_store = IndexStore(INDEX_PATH)
+
+def fetch_page(path: str, page: int, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    resp = client.get(path, params={**(params or {}), "page": page, "page_size": PAGE_SIZE})
+    resp.raise_for_status()
+    return resp.json()
+
+def fetch_all_pages(path: str, params: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+    """Yield every record of a paginated list endpoint, fetching pages after the first concurrently."""
+    first = fetch_page(path, 1, params)
+    yield from first.get("results", [])
+    last_page = first.get("last_page", 1)
+    if last_page <= 1:
+        return
+    with ThreadPoolExecutor(max_workers=LOAD_WORKERS, thread_name_prefix="aspace-load") as pool:
+        for body in pool.map(lambda page: fetch_page(path, page, params), range(2, last_page + 1)):
+            yield from body.get("results", [])
+
+def record_id(uri: str) -> int:
+    return int(uri.rsplit("/", 1)[-1])
+
+def load_namespace(namespace: Namespace, path: str, key_of: Callable[[Dict[str, Any]], Optional[str]]) -> Namespace:
+    """Bring the stored index for ``namespace`` up to date and load it into memory.
+
+    A stored index is refreshed with the records modified since its last refresh, and entries
+    whose ids ArchivesSpace no longer lists are dropped. Without a stored index it is rebuilt
+    from a full listing.
+    """
+    kind = namespace.kind
+    started = int(time.time())
+    refreshed_at = index_store.refreshed_at(kind)
+    entries = (
+        (key, record_id(rec["uri"]), rec["uri"], rec["lock_version"], rec)
+        for rec in fetch_all_pages(path, {"modified_since": refreshed_at - REFRESH_OVERLAP_SECONDS} if refreshed_at else None)
+        if (key := key_of(rec))
+    )
+    if refreshed_at is None:
+        logging.info("Building %s index from a full listing.", kind)
+        index_store.replace_all(kind, entries)
+    else:
+        ids = set(client.get(path, params={"all_ids": True}).json())
+        removed = index_store.retain_ids(kind, ids)
+        index_store.put_many(kind, entries)
+        logging.info("Refreshed %s index since %s; dropped %s deleted records.", kind, refreshed_at, removed)
+    index_store.mark_refreshed(kind, started)
+
+    namespace.load(index_store.load(kind).items())
+    return namespace
+
+def load_existing_index() -> ArchivesSpaceIndex:
+    index = ArchivesSpaceIndex(index_store)
+    load_namespace(index.resources, f"/repositories/{REPO_ID}/resources", lambda rec: rec.get("id_0"))
+    load_namespace(index.subjects, "/subjects", lambda rec: (rec.get("terms") or [{}])[0].get("term"))
+    load_namespace(index.agents, "/agents/corporate_entities", lambda rec: (rec.get("names") or [{}])[0].get("primary_name"))
+    return index
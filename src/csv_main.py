@@ -1,186 +1,246 @@
-import logging, time, os, requests, csv
+import logging, os, csv
+import glob
+import gzip
 import ssl
+from functools import partial
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 from urllib.error import URLError
 
-from cache        import load_existing_resources, load_existing_subjects, load_existing_agents
+from aspace_index import ArchivesSpaceIndex
+from authority_resolver import LINK_MODE, AuthorityResolver
+from authority_sync import link_resources, process_authorities
+from cache        import load_existing_index
+from deletion     import delete_unused
+from planner      import PLAN_MODE, PLAN_PATH, Planner, apply_plan
 from csv_mapping  import build_resource_json
-from updater      import upsert_resource, update_resource, delete_resource, create_subject, update_subject, create_corporate_agent, update_corporate_agent
-from state_manager import load_state, save_state, reset_state
+from metrics      import run_metrics
+from pipeline     import Pipeline, Stage
+from profiling    import run as run_profiled
+from rate_limiter import TokenBucket
+from updater      import write_stats, log_write_stats, flush_bulk_creates, upsert_resource, delete_resource
+from state_manager import load_state, save_state, record_progress, reset_state
+from http_session  import log_connection_stats
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
 
-WAIT_SECONDS= int(os.getenv("ATOM_WAIT_SECONDS", "1"))
-
-def read_csv_records(csv_path: str):
-    """Read records from the CSV file and yield each as a dict."""
-    with open(csv_path, newline='', encoding='utf-8') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            yield row
-
-def process_all_records(cache: dict, processed_ids: set, state: dict) -> int:
-    csv_path = os.path.join(os.path.dirname(__file__), 'data.csv')
-    total = 0
-    for i, detail in enumerate(read_csv_records(csv_path), start=1):
+# Comma-separated CSV exports, read in order; entries may be glob patterns, and .gz files are decompressed
+CSV_PATHS       = os.getenv("CSV_PATHS", os.path.join(os.path.dirname(__file__), "data.csv"))
+# Rows mapped by one worker at a time, and chunks buffered between two stages
+CSV_CHUNK_SIZE  = int(os.getenv("CSV_CHUNK_SIZE", "50"))
+CSV_QUEUE_CHUNKS = int(os.getenv("CSV_QUEUE_CHUNKS", "8"))
+# Pipeline stages, configured as for the AtoM sync
+MAP_WORKERS       = int(os.getenv("PIPELINE_MAP_WORKERS", "2"))
+WRITE_WORKERS     = int(os.getenv("ASPACE_WRITE_WORKERS", "2"))
+# Sustained ArchivesSpace write rate; 0 leaves writes unthrottled
+WRITES_PER_SECOND = float(os.getenv("ASPACE_WRITES_PER_SECOND", "0"))
+
+write_limiter = TokenBucket(WRITES_PER_SECOND, WRITE_WORKERS) if WRITES_PER_SECOND > 0 else None
+
+def csv_files(paths: str = CSV_PATHS) -> List[str]:
+    """The files named by ``paths``, in order; each glob pattern contributes its matches sorted by name."""
+    files = []
+    for entry in (path.strip() for path in paths.split(",")):
+        if any(char in entry for char in "*?["):
+            files.extend(sorted(glob.glob(entry)))
+        elif entry:
+            files.append(entry)
+    return files
+
+def open_csv(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", newline="", encoding="utf-8")
+    return open(path, newline="", encoding="utf-8")
+
+def read_csv_records(paths: Optional[Iterable[str]] = None) -> Iterator[Dict[str, str]]:
+    """Stream the rows of every CSV file as dicts, one file after another, without loading a file whole."""
+    for path in csv_files() if paths is None else paths:
+        logging.info("Reading %s", path)
+        with open_csv(path) as csvfile:
+            yield from csv.DictReader(csvfile)
+
+def access_point_terms(detail: dict) -> dict:
+    """Access point columns of a CSV row by role; event actors are names in the "creator" role."""
+    return {
+        role: detail.get(column, "").split("|") if detail.get(column) else []
+        for role, column in (("subject", "subjectAccessPoints"), ("place", "placeAccessPoints"),
+                             ("name", "nameAccessPoints"), ("creator", "eventActors"))
+    }
+
+def plan_records(index: ArchivesSpaceIndex) -> None:
+    """Map every CSV row as a run would, and write the resulting plan instead of syncing."""
+    planner = Planner(index, PLAN_PATH, "csv", "full")
+    for i, detail in enumerate(read_csv_records(), start=1):
         identifier = detail.get("referenceCode") or detail.get("identifier") or str(i)
         try:
-            logging.info("Processing record %s: %s", i, identifier)
             rsrc = build_resource_json(detail, identifier)
-            upsert_resource(rsrc, cache)
-            processed_ids.add(rsrc["id_0"])
-
-            # Extract access points and save them to state
-            id_0 = rsrc["id_0"]
-            state.setdefault("access_points", {})[id_0] = {
-                "subject": detail.get("subjectAccessPoints", "").split("|") if detail.get("subjectAccessPoints") else [],
-                "place": detail.get("placeAccessPoints", "").split("|") if detail.get("placeAccessPoints") else [],
-                "name": detail.get("nameAccessPoints", "").split("|") if detail.get("nameAccessPoints") else [],
-                "creator": detail.get("eventActors", "").split("|") if detail.get("eventActors") else [],
-            }
-
-            # Ensure state keys are initialized as sets
-            state["unique_subjects"] = set(state.get("unique_subjects", []))
-            state["unique_places"] = set(state.get("unique_places", []))
-            state["unique_names"] = set(state.get("unique_names", []))
-
-            # Update unique sets
-            state["unique_subjects"].update(state["access_points"][id_0]["subject"])
-            state["unique_places"].update(state["access_points"][id_0]["place"])
-            state["unique_names"].update(state["access_points"][id_0]["name"])
-
-            # Process creators as agents (if needed, can be expanded)
-            for creator in state["access_points"][id_0]["creator"]:
-                if creator:
-                    state.setdefault("unique_names", set()).add(creator)
-
+            planner.resource(rsrc["id_0"], rsrc, access_point_terms(detail))
+            run_metrics.count_records("plan")
         except Exception as e:
-            logging.error("Error processing record '%s': %s", identifier, e)
-            continue  # Move on to the next record
-
-        time.sleep(WAIT_SECONDS)
-        total += 1
-    return total
-
-def process_access_points(state, cache):
-    # Process unique subjects
-    for subject in state.get("unique_subjects", []):
-        subject_data = {
-            "source": "local",
-            "term_type": "topical",
-            "id_0": subject,
-        }
-        try:
-            if subject in cache:
-                logging.info("Updating existing subject: %s", subject)
-                update_subject(subject_data, cache[subject])
-            else:
-                logging.info("Creating new subject: %s", subject)
-                create_subject(subject_data, cache)
-        except requests.exceptions.RequestException as e:
-            logging.error("✖ Create/Update failed for subject %s: %s", subject, e.response.json())
-
-    # Process unique places
-    for place in state.get("unique_places", []):
-        place_data = {
-            "source": "local",
-            "term_type": "geographic",
-            "id_0": place,
-        }
+            logging.error("Error planning record '%s': %s", identifier, e)
+    planner.authorities()
+    planner.links()
+    planner.deletions()
+    planner.close()
+
+class CsvRecord:
+    """One mapped CSV row; ``error`` is set when mapping or writing it failed."""
+
+    __slots__ = ("identifier", "rsrc", "terms", "error")
+
+    def __init__(self, identifier: str):
+        self.identifier = identifier
+        self.rsrc: Optional[Dict[str, Any]] = None
+        self.terms: Dict[str, List[str]] = {}
+        self.error: Optional[Exception] = None
+
+class CsvChunk:
+    """Consecutive CSV rows on their way through the map and write stages."""
+
+    __slots__ = ("start", "end", "rows", "records")
+
+    def __init__(self, start: int, rows: List[Dict[str, str]]):
+        self.start = start
+        self.end = start + len(rows) - 1
+        self.rows = rows
+        self.records: List[CsvRecord] = []
+
+def read_chunks(rows: Iterator[Dict[str, str]], size: int) -> Iterator[CsvChunk]:
+    start = 1
+    while chunk := list(islice(rows, max(1, size))):
+        yield CsvChunk(start, chunk)
+        start += len(chunk)
+
+def map_chunk(resolver: AuthorityResolver | None, chunk: CsvChunk) -> CsvChunk:
+    for i, detail in enumerate(chunk.rows, start=chunk.start):
+        record = CsvRecord(detail.get("referenceCode") or detail.get("identifier") or str(i))
         try:
-            if place in cache:
-                logging.info("Updating existing place: %s", place)
-                update_subject(place_data, cache[place])
-            else:
-                logging.info("Creating new place: %s", place)
-                create_subject(place_data, cache)
-        except requests.exceptions.RequestException as e:
-            logging.error("✖ Create/Update failed for place %s: %s", place, e.response.json())
-
-    # Process unique names
-    for name in state.get("unique_names", []):
-        agent_data = {
-            "id_0": name,
-        }
-        try:
-            if name in cache:
-                logging.info("Updating existing corporate agent: %s", name)
-                update_corporate_agent(agent_data, cache[name])
-            else:
-                logging.info("Creating new corporate agent: %s", name)
-                create_corporate_agent(agent_data, cache)
-        except requests.exceptions.RequestException as e:
-            logging.error("✖ Create/Update failed for corporate agent %s: %s", name, e.response.json())
-
-    # Update resources to link subjects and agents
-    for resource_id, access_points in state.get("access_points", {}).items():
-        resource_meta = cache.get(resource_id)
-        if not resource_meta:
-            logging.warning("Resource ID %s not found in cache. Skipping.", resource_id)
+            record.terms = access_point_terms(detail)
+            record.rsrc = build_resource_json(detail, record.identifier)
+            if resolver:
+                # Resolve links first so the resource is written once, already linked
+                links = resolver.links(*record.terms.values())
+                record.rsrc["subjects"], record.rsrc["linked_agents"] = links.subjects, links.linked_agents
+                if links.unresolved:
+                    # Every row is written again next run, which retries these links
+                    logging.warning("Unresolved access points for %s: %s", record.identifier, ", ".join(links.unresolved))
+        except Exception as e:
+            record.error = e
+        chunk.records.append(record)
+    chunk.rows = []  # Only the mapped records travel on
+    return chunk
+
+def write_chunk(index: ArchivesSpaceIndex, chunk: CsvChunk) -> CsvChunk:
+    for record in chunk.records:
+        if record.error is not None:
             continue
+        # Throttled per record, so ASPACE_WRITES_PER_SECOND counts writes rather than chunks
+        if write_limiter:
+            write_limiter.acquire()
+        try:
+            upsert_resource(record.rsrc, index.resources)
+        except Exception as e:
+            record.error = e
+    return chunk
 
-        linked_subjects = [
-            {"ref": cache[sub]["uri"]} for sub in access_points.get("subject", []) if sub in cache
-        ]
-        linked_places = [
-            {"ref": cache[place]["uri"]} for place in access_points.get("place", []) if place in cache
-        ]
-        linked_agents = [
-            {"ref": cache[name]["uri"], "role": "subject"} for name in access_points.get("name", []) if name in cache
-        ]
-
-        # Add creators with role "subject" and only the first creator with role "creator"
-        linked_creators = []
-        for idx, creator in enumerate(access_points.get("creator", [])):
-            creator_id = creator  # Treat creator as a string from CSV
-            if creator_id in cache:
-                if idx == 0:  # Add only the first creator with role "creator"
-                    linked_creators.append({"ref": cache[creator_id]["uri"], "role": "creator"})
-                else:
-                    linked_creators.append({"ref": cache[creator_id]["uri"], "role": "subject"})
-
-        # Update only the necessary fields while preserving existing properties
-        resource_update = {
-            "id_0": resource_id,
-            "subjects": linked_subjects + linked_places,
-            "linked_agents": linked_agents + linked_creators,
-        }
+def process_all_records(index: ArchivesSpaceIndex, processed_ids: set, state: dict,
+                        resolver: AuthorityResolver | None = None) -> Tuple[int, bool]:
+    """Stream every CSV row through the map → write pipeline; return the records synced and whether every file was read.
 
-        try:
-            logging.info("Updating resource %s with linked subjects and agents.", resource_id)
-            update_resource(resource_update, resource_meta)
-        except requests.exceptions.RequestException as e:
-            logging.error("✖ Update failed for resource %s: %s", resource_id, e.response.json())
+    Rows are read ``CSV_CHUNK_SIZE`` at a time and the queues between stages hold a few
+    chunks, so memory stays bounded however large the exports are.
+    """
+    complete = False
+
+    def chunks() -> Iterator[CsvChunk]:
+        nonlocal complete
+        yield from read_chunks(read_csv_records(), CSV_CHUNK_SIZE)
+        complete = True
+
+    pipeline = Pipeline(chunks(), [
+        Stage("map", partial(map_chunk, resolver), MAP_WORKERS),
+        Stage("write", partial(write_chunk, index), WRITE_WORKERS),
+    ], CSV_QUEUE_CHUNKS)
+
+    total = 0
+    for chunk, error in pipeline.run():
+        if error is not None:
+            logging.error("Error processing rows %s-%s: %s", chunk.start, chunk.end, error)
+            continue
+        for record in chunk.records:
+            if record.error is not None:
+                logging.error("Error processing record '%s': %s", record.identifier, record.error)
+                continue
+            processed_ids.add(record.rsrc["id_0"])
+
+            # Register access points with the shared registry
+            record_progress(state, record.rsrc["id_0"], record.terms)
+            total += 1
+            run_metrics.count_records("resources")
+        # Journal the chunk's access points now, so buffered state stays bounded by the chunk size
+        save_state(state)
+        logging.info("Processed rows %s-%s.", chunk.start, chunk.end)
+
+    pipeline.log_stats()
+    return total, complete
 
 def main():
-    state = load_state()
-    cache = load_existing_resources()
+    if PLAN_MODE == "apply":
+        with run_metrics.phase("index"):
+            index = load_existing_index()
+        with run_metrics.phase("apply"):
+            apply_plan(PLAN_PATH, index)
+        log_write_stats()
+        log_connection_stats()
+        run_metrics.export(write_stats)
+        return
+    if PLAN_MODE == "plan":
+        with run_metrics.phase("index"):
+            index = load_existing_index()
+        with run_metrics.phase("plan"):
+            plan_records(index)
+        log_connection_stats()
+        run_metrics.export(write_stats)
+        return
 
-    # Load existing subjects and agents into the cache
-    cache.update(load_existing_subjects())
-    cache.update(load_existing_agents())
+    state = load_state()
+    # Resources, subjects and agents are indexed in separate namespaces
+    with run_metrics.phase("index"):
+        index = load_existing_index()
 
     processed_ids = set()
 
-    # Process all records (no batching, no skip)
-    total = process_all_records(cache, processed_ids, state)
+    # Process all records (no skip)
+    resolver = AuthorityResolver(index) if LINK_MODE == "inline" else None
+    with run_metrics.phase("resources"):
+        total, complete = process_all_records(index, processed_ids, state, resolver)
+        # Create whatever is still queued for a batch import
+        flush_bulk_creates()
     state["total"] = total
     save_state(state)
     logging.info("Processed %s records.", total)
 
-    # Call process_access_points after processing resources
-    process_access_points(state, cache)
+    # Create or update authorities and link resources to them; inline mode has already linked them
+    if resolver is None:
+        with run_metrics.phase("authorities"):
+            process_authorities(state, index)
+        with run_metrics.phase("linking"):
+            link_resources(state, index)
 
-    # Delete unused resources
-    unused_ids = set(cache.keys()) - processed_ids
-    for unused_id in unused_ids:
-        time.sleep(WAIT_SECONDS)
-        delete_resource(cache[unused_id])
-        del cache[unused_id]
+    # Delete unused resources; after a read error the missing rows would look unused too
+    if complete:
+        with run_metrics.phase("deletion"):
+            delete_unused(index.resources, processed_ids, delete_resource)
+    else:
+        logging.warning("Not every CSV file could be read; skipping deletion.")
 
     # Reset state back to initial defaults
-    reset_state()
+    reset_state(state)
     logging.info("state.json has been reset to initial values.")
+    log_write_stats()
+    log_connection_stats()
+    run_metrics.export(write_stats)
     
 
 if __name__ == "__main__":
-    main()
+    run_profiled(main)
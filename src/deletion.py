@@ -0,0 +1,100 @@
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List
+
+import requests
+
+from aspace_index import IndexEntry, Namespace
+from cache import client
+
+# URIs per /batch_delete request; 0 deletes every record with its own request
+DELETE_BATCH_SIZE = int(os.getenv("ASPACE_DELETE_BATCH_SIZE", "50"))
+# Concurrent single-record deletes when batching is off or a batch is rejected
+DELETE_WORKERS = int(os.getenv("ASPACE_DELETE_WORKERS", "4"))
+# Largest share of a namespace one run may delete before the phase refuses to run
+MAX_DELETE_FRACTION = float(os.getenv("ASPACE_MAX_DELETE_FRACTION", "0.2"))
+# Only write the report of what would be deleted
+DELETE_DRY_RUN = os.getenv("ASPACE_DELETE_DRY_RUN", "false").lower() in ("1", "true", "yes")
+DELETE_REPORT_PATH = os.getenv("ASPACE_DELETE_REPORT_PATH", "deletion_report.json")
+
+def write_report(namespace: Namespace, unused: List[IndexEntry], outcome: str) -> None:
+    """Write the records selected for deletion, and what happened to them, to DELETE_REPORT_PATH."""
+    if not DELETE_REPORT_PATH:
+        return
+    report: Dict[str, Any] = {
+        "generated": datetime.now(timezone.utc).isoformat(),
+        "kind": namespace.kind,
+        "outcome": outcome,
+        "indexed": len(namespace),
+        "selected": len(unused),
+        "max_fraction": MAX_DELETE_FRACTION,
+        "records": [{"id_0": entry.key, "uri": entry.uri} for entry in sorted(unused, key=lambda e: e.key)],
+    }
+    with open(DELETE_REPORT_PATH, "w") as f:
+        json.dump(report, f, indent=2)
+    logging.info("Deletion report written to %s", DELETE_REPORT_PATH)
+
+def batch_delete(entries: List[IndexEntry], namespace: Namespace) -> bool:
+    """Delete ``entries`` with one /batch_delete request; ArchivesSpace rolls back the whole batch on any failure."""
+    try:
+        resp = client.post("/batch_delete", params={"record_uris[]": [entry.uri for entry in entries]})
+    except requests.exceptions.RequestException as e:
+        logging.error("✖ Batch delete request failed: %s", e)
+        return False
+    if not resp.ok:
+        logging.error("✖ Batch delete of %s %s was rejected: %s", len(entries), namespace.kind, resp.text)
+        return False
+    for entry in entries:
+        namespace.remove(entry)
+        logging.info("✔ Deleted %s from %s", entry.key, namespace.kind)
+    return True
+
+def delete_each(entries: Iterable[IndexEntry], namespace: Namespace,
+                delete_one: Callable[[IndexEntry, Namespace], None]) -> None:
+    with ThreadPoolExecutor(max_workers=max(1, DELETE_WORKERS), thread_name_prefix="aspace-delete") as pool:
+        for _ in pool.map(lambda entry: delete_one(entry, namespace), entries):
+            pass
+
+def select_unused(namespace: Namespace, keep: Iterable[str]) -> List[IndexEntry]:
+    """Entries in ``namespace`` whose identifier is not in ``keep``."""
+    return [namespace[key] for key in namespace.keys() - set(keep)]
+
+def delete_unused(namespace: Namespace, keep: Iterable[str], delete_one: Callable[[IndexEntry, Namespace], None]) -> int:
+    """Delete the records in ``namespace`` whose identifier is not in ``keep``; return how many were selected."""
+    return delete_entries(namespace, select_unused(namespace, keep), delete_one)
+
+def delete_entries(namespace: Namespace, unused: List[IndexEntry], delete_one: Callable[[IndexEntry, Namespace], None]) -> int:
+    """Delete ``unused`` from ArchivesSpace and ``namespace``; return how many were selected.
+
+    Nothing is deleted in a dry run or when the selection exceeds MAX_DELETE_FRACTION of the
+    namespace; a report of the selection is written instead.
+    """
+    if not unused:
+        logging.info("No unused %s to delete.", namespace.kind)
+        return 0
+
+    if DELETE_DRY_RUN:
+        logging.info("Dry run: %s of %s %s would be deleted.", len(unused), len(namespace), namespace.kind)
+        write_report(namespace, unused, "dry_run")
+        return len(unused)
+    if len(unused) > MAX_DELETE_FRACTION * len(namespace):
+        logging.error(
+            "✖ Refusing to delete %s of %s %s: more than ASPACE_MAX_DELETE_FRACTION=%s of the index.",
+            len(unused), len(namespace), namespace.kind, MAX_DELETE_FRACTION,
+        )
+        write_report(namespace, unused, "refused")
+        return len(unused)
+
+    logging.info("Deleting %s unused %s.", len(unused), namespace.kind)
+    if DELETE_BATCH_SIZE <= 0:
+        delete_each(unused, namespace, delete_one)
+        return len(unused)
+    for start in range(0, len(unused), DELETE_BATCH_SIZE):
+        batch = unused[start:start + DELETE_BATCH_SIZE]
+        if not batch_delete(batch, namespace):
+            # One bad record fails the whole batch, so retry its records individually
+            delete_each(batch, namespace, delete_one)
+    return len(unused)
@@ -0,0 +1,71 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, NamedTuple, Optional
+
+CACHE_PATH  = os.getenv("ATOM_CACHE_PATH", "atom_cache.sqlite")
+# Entries older than this are dropped and downloaded in full, forcing a periodic rewrite
+TTL_SECONDS = int(os.getenv("ATOM_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+
+class CachedDetail(NamedTuple):
+    payload: Dict[str, Any]
+    content_hash: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float
+
+def content_hash(payload: Dict[str, Any]) -> str:
+    """Stable SHA-256 of a detail payload, independent of key order."""
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class DetailCache:
+    """SQLite-backed store of AtoM detail payloads keyed by slug."""
+
+    def __init__(self, path: str, ttl_seconds: int = TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        # Fetch workers read from the cache while the main thread writes to it
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS details (
+                   slug TEXT PRIMARY KEY,
+                   payload TEXT NOT NULL,
+                   content_hash TEXT NOT NULL,
+                   etag TEXT,
+                   last_modified TEXT,
+                   fetched_at REAL NOT NULL
+               )"""
+        )
+        self._conn.commit()
+
+    def get(self, slug: str) -> Optional[CachedDetail]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload, content_hash, etag, last_modified, fetched_at FROM details WHERE slug = ?",
+                (slug,),
+            ).fetchone()
+        if row is None:
+            return None
+        return CachedDetail(json.loads(row[0]), row[1], row[2], row[3], row[4])
+
+    def put(self, slug: str, payload: Dict[str, Any], digest: str, etag: Optional[str] = None,
+            last_modified: Optional[str] = None) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO details (slug, payload, content_hash, etag, last_modified, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (slug, json.dumps(payload, ensure_ascii=False), digest, etag, last_modified, time.time()),
+            )
+            self._conn.commit()
+
+    def evict_expired(self) -> int:
+        """Delete entries older than the TTL and return how many were removed."""
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM details WHERE fetched_at < ?", (cutoff,))
+            self._conn.commit()
+        return cur.rowcount
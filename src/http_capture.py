@@ -0,0 +1,174 @@
+import atexit
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# "record" writes every HTTP exchange to CAPTURE_PATH; "replay" answers requests from it without the network
+CAPTURE_MODE = os.getenv("HTTP_CAPTURE_MODE", "").lower()
+CAPTURE_PATH = os.getenv("HTTP_CAPTURE_PATH", "http_capture.jsonl.gz")
+# Replayed responses take their recorded latency times this factor; 0 answers immediately
+REPLAY_TIME_SCALE = float(os.getenv("HTTP_REPLAY_TIME_SCALE", "1"))
+
+# Response headers the sync reads; the rest are not kept
+KEPT_HEADERS = ("Content-Type", "ETag", "Last-Modified")
+# Query parameters never written to the capture
+REDACTED_PARAMS = {"password"}
+# ArchivesSpace login; its response carries the session token
+LOGIN_PATH = re.compile(r"/users/[^/]+/login$")
+
+def request_target(url: str) -> str:
+    """Path and query of ``url`` without secrets; the host is left out so a capture replays against any base URL.
+
+    Query parameters are sorted, since lists such as ``record_uris[]`` are built from sets
+    and their order changes from run to run.
+    """
+    parts = urlsplit(url)
+    query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True) if key not in REDACTED_PARAMS)
+    return parts.path + (f"?{urlencode(query)}" if query else "")
+
+def response_text(target: str, response: requests.Response) -> str:
+    """Response body as written to the capture; a login's session token is replaced, since replay only needs some token."""
+    text = response.content.decode("utf-8", errors="replace")
+    if not LOGIN_PATH.search(target.split("?", 1)[0]):
+        return text
+    try:
+        body = json.loads(text)
+    except ValueError:
+        return text
+    if isinstance(body, dict) and "session" in body:
+        body["session"] = "redacted"
+        text = json.dumps(body)
+    return text
+
+def body_digest(body: Any) -> Optional[str]:
+    if not body:
+        return None
+    return hashlib.sha1(body if isinstance(body, bytes) else body.encode()).hexdigest()[:16]
+
+class HttpRecorder:
+    """Appends every request and its response, or the error it raised, to a gzip-compressed JSON-lines file.
+
+    Request bodies and headers are not stored, only a digest of the body, and the session
+    token in login responses is redacted, so API keys and session tokens stay out of the capture.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.started = time.monotonic()
+        self.count = 0
+        self._lock = threading.Lock()
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+
+    def record(self, service: str, request: requests.PreparedRequest, elapsed: float,
+               response: Optional[requests.Response] = None, error: Optional[Exception] = None) -> None:
+        target = request_target(request.url)
+        entry: Dict[str, Any] = {
+            "t": round(time.monotonic() - self.started - elapsed, 4),
+            "service": service,
+            "method": request.method,
+            "target": target,
+            "body": body_digest(request.body),
+            "elapsed": round(elapsed, 4),
+        }
+        if response is not None:
+            entry["status"] = response.status_code
+            entry["headers"] = {name: response.headers[name] for name in KEPT_HEADERS if name in response.headers}
+            entry["response"] = response_text(target, response)
+        else:
+            entry["error"] = type(error).__name__
+            entry["message"] = str(error)
+        line = json.dumps(entry, separators=(",", ":"))
+        with self._lock:
+            self._file.write(line + "\n")
+            self.count += 1
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+        logging.info("Recorded %s HTTP exchanges to %s", self.count, self.path)
+
+class HttpReplay:
+    """Answers requests with the responses recorded for the same method and target, in recorded order.
+
+    A request whose body matches a recorded one gets that response; otherwise the next
+    response recorded for the method and target is used, since payloads carry per-run
+    timestamps. Once a target's responses are used up, its last one is repeated.
+    """
+
+    def __init__(self, path: str, time_scale: float = REPLAY_TIME_SCALE):
+        self.time_scale = time_scale
+        self.missing = 0
+        self.answered = 0
+        self._lock = threading.Lock()
+        self._exact: Dict[Tuple[str, str, str, Optional[str]], Deque[Dict[str, Any]]] = defaultdict(deque)
+        self._by_target: Dict[Tuple[str, str, str], Deque[Dict[str, Any]]] = defaultdict(deque)
+        self._last: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+        self.recorded = 0
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                key = (entry["service"], entry["method"], entry["target"])
+                self._exact[key + (entry["body"],)].append(entry)
+                self._by_target[key].append(entry)
+                self.recorded += 1
+
+    def _take(self, key: Tuple[str, str, str], digest: Optional[str]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            exact, by_target = self._exact.get(key + (digest,)), self._by_target.get(key)
+            entry = exact[0] if exact else by_target[0] if by_target else None
+            if entry is None:
+                return self._last.get(key)
+            # Each recorded exchange is answered once, whichever queue it is found through
+            by_target.remove(entry)
+            self._exact[key + (entry["body"],)].remove(entry)
+            self._last[key] = entry
+            self.answered += 1
+            return entry
+
+    def respond(self, service: str, request: requests.PreparedRequest) -> requests.Response:
+        key = (service, request.method, request_target(request.url))
+        entry = self._take(key, body_digest(request.body))
+        if entry is None:
+            with self._lock:
+                self.missing += 1
+            raise requests.exceptions.ConnectionError(f"No recorded response for {request.method} {key[2]}", request=request)
+        if self.time_scale > 0:
+            time.sleep(entry["elapsed"] * self.time_scale)
+        if "error" in entry:
+            error = getattr(requests.exceptions, entry["error"], requests.exceptions.ConnectionError)
+            raise error(entry["message"], request=request)
+
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response._content = entry["response"].encode("utf-8")
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self) -> None:
+        logging.info("Replayed %s of %s recorded HTTP exchanges", self.answered, self.recorded)
+        if self.missing:
+            logging.warning("%s requests had no recorded response", self.missing)
+
+recorder = HttpRecorder(CAPTURE_PATH) if CAPTURE_MODE == "record" else None
+replay = HttpReplay(CAPTURE_PATH) if CAPTURE_MODE == "replay" else None
+
+@atexit.register
+def close_capture() -> None:
+    """Finish the capture file, or report requests the replay could not answer; runs at exit, even after a crash."""
+    for capture in (recorder, replay):
+        if capture:
+            capture.close()
@@ -0,0 +1,150 @@
+import logging
+import os
+import ssl
+import threading
+import time
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import PoolManager
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from http_capture import recorder, replay
+from metrics import run_metrics
+
+# Keep-alive connections kept open per host, shared by every thread using the session
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+
+class ConnectionStats:
+    """Counts requests sent through an adapter and the connections opened to serve them."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+
+    def request_sent(self) -> None:
+        with self._lock:
+            self.requests += 1
+
+    def connection_opened(self) -> None:
+        with self._lock:
+            self.new_connections += 1
+
+    @property
+    def reused_connections(self) -> int:
+        return max(0, self.requests - self.new_connections)
+
+    def as_dict(self) -> Dict[str, int]:
+        return {
+            "requests": self.requests,
+            "new_connections": self.new_connections,
+            "reused_connections": self.reused_connections,
+        }
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    stats: Optional[ConnectionStats] = None
+
+    def _new_conn(self):
+        if self.stats:
+            self.stats.connection_opened()
+        return super()._new_conn()
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    stats: Optional[ConnectionStats] = None
+
+    def _new_conn(self):
+        if self.stats:
+            self.stats.connection_opened()
+        return super()._new_conn()
+
+class CountingPoolManager(PoolManager):
+    """PoolManager whose host pools report every connection they open to ``stats``."""
+
+    def __init__(self, *args, stats: ConnectionStats, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = stats
+        self.pool_classes_by_scheme = {"http": CountingHTTPConnectionPool, "https": CountingHTTPSConnectionPool}
+
+    def _new_pool(self, scheme, host, port, request_context=None):
+        pool = super()._new_pool(scheme, host, port, request_context)
+        pool.stats = self.stats
+        return pool
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter with a fixed pool size, a preloaded SSL context, connection counters and request timings."""
+
+    def __init__(self, pool_size: int = POOL_SIZE, ssl_context: Optional[ssl.SSLContext] = None, name: str = "http"):
+        self.name = name
+        # Both are read by init_poolmanager, which HTTPAdapter.__init__ calls
+        self.ssl_context = ssl_context
+        self.stats = ConnectionStats()
+        super().__init__(pool_connections=pool_size, pool_maxsize=pool_size)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        if self.ssl_context is not None:
+            # The context is built once, so certificates are not re-read for every connection
+            pool_kwargs["ssl_context"] = self.ssl_context
+        # Same attributes as HTTPAdapter.init_poolmanager sets, with a counting pool manager
+        self._pool_connections = connections
+        self._pool_maxsize = maxsize
+        self._pool_block = block
+        self.poolmanager = CountingPoolManager(num_pools=connections, maxsize=maxsize, block=block,
+                                               stats=self.stats, **pool_kwargs)
+
+    def cert_verify(self, conn, url, verify, cert):
+        super().cert_verify(conn, url, verify, cert)
+        if self.ssl_context is not None and url.lower().startswith("https"):
+            # The preloaded context is the trust store: a CA bundle set here would be loaded
+            # into it again for every new connection, and would widen trust to the system roots
+            conn.cert_reqs = "CERT_REQUIRED"
+            conn.ca_certs = None
+            conn.ca_cert_dir = None
+
+    def send(self, request, **kwargs):
+        self.stats.request_sent()
+        started = time.monotonic()
+        status = "error"  # No response: connection failure or timeout
+        try:
+            response = replay.respond(self.name, request) if replay else super().send(request, **kwargs)
+            status = str(response.status_code)
+            if not kwargs.get("stream"):
+                response.content  # Read the body here, so latency and captures cover the whole transfer
+        except Exception as e:
+            if recorder:
+                recorder.record(self.name, request, time.monotonic() - started, error=e)
+            raise
+        finally:
+            run_metrics.observe_request(self.name, request.method, request.url, status, time.monotonic() - started)
+        if recorder:
+            recorder.record(self.name, request, time.monotonic() - started, response=response)
+        return response
+
+_adapters: Dict[str, PooledAdapter] = {}
+
+def mount_pool(name: str, session: requests.Session, ssl_context: Optional[ssl.SSLContext] = None) -> requests.Session:
+    """Mount a pooled adapter on ``session`` for both schemes and register it under ``name``."""
+    adapter = PooledAdapter(ssl_context=ssl_context, name=name)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    _adapters[name] = adapter
+    return session
+
+def new_session(name: str, ssl_context: Optional[ssl.SSLContext] = None, headers: Optional[Dict[str, str]] = None) -> requests.Session:
+    """Create a keep-alive session backed by a pooled adapter."""
+    session = requests.Session()
+    if headers:
+        session.headers.update(headers)
+    return mount_pool(name, session, ssl_context)
+
+def connection_stats() -> Dict[str, Dict[str, int]]:
+    """Return request and connection counters for every registered session."""
+    return {name: adapter.stats.as_dict() for name, adapter in _adapters.items()}
+
+def log_connection_stats() -> None:
+    for name, stats in connection_stats().items():
+        logging.info(
+            "HTTP %s: %s requests, %s new connections, %s reused",
+            name, stats["requests"], stats["new_connections"], stats["reused_connections"],
+        )
@@ -0,0 +1,127 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+INDEX_PATH = os.getenv("ASPACE_INDEX_PATH", "aspace_index.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    uri TEXT NOT NULL UNIQUE,
+    lock_version INTEGER NOT NULL,
+    record TEXT,
+    PRIMARY KEY (kind, key)
+);
+CREATE TABLE IF NOT EXISTS refreshes (
+    kind TEXT PRIMARY KEY,
+    refreshed_at INTEGER NOT NULL
+);
+"""
+
+# (key, id, uri, lock_version, last known full record or None)
+Entry = Tuple[str, int, str, int, Optional[Dict[str, Any]]]
+
+class IndexStore:
+    """SQLite copy of the ArchivesSpace identifier → (id, uri, lock_version) index, per record kind.
+
+    The last known full JSON of each record is kept alongside, so updates can be merged and
+    diffed without fetching the record again.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = self._open()
+
+    def _open(self) -> sqlite3.Connection:
+        try:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            if conn.execute("PRAGMA quick_check").fetchone()[0] != "ok":
+                raise sqlite3.DatabaseError("quick_check failed")
+            conn.executescript(SCHEMA)
+            # Files written before records were stored lack the column
+            if "record" not in {row[1] for row in conn.execute("PRAGMA table_info(entries)")}:
+                conn.execute("ALTER TABLE entries ADD COLUMN record TEXT")
+            return conn
+        except sqlite3.DatabaseError as e:
+            if self.path == ":memory:":
+                raise
+            # A corrupt index is only a cache of ArchivesSpace, so start again from an empty file
+            logging.warning("Index store %s is unreadable (%s); rebuilding it.", self.path, e)
+            os.remove(self.path)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.executescript(SCHEMA)
+            return conn
+
+    def refreshed_at(self, kind: str) -> Optional[int]:
+        with self._lock:
+            row = self._conn.execute("SELECT refreshed_at FROM refreshes WHERE kind = ?", (kind,)).fetchone()
+        return row[0] if row else None
+
+    def mark_refreshed(self, kind: str, timestamp: int) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO refreshes (kind, refreshed_at) VALUES (?, ?)", (kind, timestamp))
+
+    def load(self, kind: str) -> Dict[str, Tuple[int, str, int]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT key, id, uri, lock_version FROM entries WHERE kind = ?", (kind,)).fetchall()
+        return {key: (rid, uri, lock_version) for key, rid, uri, lock_version in rows}
+
+    def replace_all(self, kind: str, entries: Iterable[Entry]) -> None:
+        """Swap every entry of ``kind`` for ``entries`` in a single transaction."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entries WHERE kind = ?", (kind,))
+            self._conn.execute("DELETE FROM refreshes WHERE kind = ?", (kind,))
+            for entry in entries:
+                self._put(kind, entry)
+
+    def put_many(self, kind: str, entries: Iterable[Entry]) -> None:
+        with self._lock, self._conn:
+            for entry in entries:
+                self._put(kind, entry)
+
+    def put(self, kind: str, key: str, rid: int, uri: str, lock_version: int,
+            record: Optional[Dict[str, Any]] = None) -> None:
+        with self._lock, self._conn:
+            self._put(kind, (key, rid, uri, lock_version, record))
+
+    def _put(self, kind: str, entry: Entry) -> None:
+        key, rid, uri, lock_version, record = entry
+        # A record whose identifier changed keeps its URI, so drop the row under its old key first
+        self._conn.execute("DELETE FROM entries WHERE uri = ? OR (kind = ? AND key = ?)", (uri, kind, key))
+        self._conn.execute(
+            "INSERT INTO entries (kind, key, id, uri, lock_version, record) VALUES (?, ?, ?, ?, ?, ?)",
+            (kind, key, rid, uri, lock_version, json.dumps(record) if record is not None else None),
+        )
+
+    def record(self, uri: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT record FROM entries WHERE uri = ?", (uri,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def set_record(self, uri: str, lock_version: int, record: Optional[Dict[str, Any]]) -> None:
+        """Store a new lock_version together with the record it belongs to (None if unknown)."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE entries SET lock_version = ?, record = ? WHERE uri = ?",
+                (lock_version, json.dumps(record) if record is not None else None, uri),
+            )
+
+    def remove(self, uri: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entries WHERE uri = ?", (uri,))
+
+    def retain_ids(self, kind: str, ids: Set[int]) -> int:
+        """Remove entries of ``kind`` whose record id is not in ``ids``; return how many were removed."""
+        with self._lock, self._conn:
+            stale = [
+                (rid,) for (rid,) in self._conn.execute("SELECT id FROM entries WHERE kind = ?", (kind,))
+                if rid not in ids
+            ]
+            self._conn.executemany("DELETE FROM entries WHERE kind = ? AND id = ?", [(kind, rid) for (rid,) in stale])
+        return len(stale)
@@ -1,216 +1,335 @@
-import logging, time, os, requests
+import logging, os
 import ssl
+from datetime import datetime, timedelta, timezone
+from functools import partial
 from urllib.error import URLError
 
-from atom_helpers import fetch_atom_detail, fetch_slugs
-from cache        import load_existing_resources, load_existing_subjects, load_existing_agents
+from atom_helpers import MAX_IN_FLIGHT, fetch_atom_detail, prefetch_slug_pages, remember_detail, evict_expired_details, log_retry_metrics
+from aspace_index import ArchivesSpaceIndex
+from authority_resolver import LINK_MODE, AuthorityResolver
+from authority_sync import link_resources, process_authorities
+from cache        import load_existing_index
+from deletion     import delete_unused
 from mapping      import build_resource_json
-from updater      import upsert_resource, update_resource, delete_resource, create_subject, update_subject, create_corporate_agent, update_corporate_agent
-from state_manager import load_state, save_state, reset_state
+from metrics      import run_metrics
+from profiling    import run as run_profiled
+from pipeline     import PageTracker, Pipeline, Stage
+from planner      import PLAN_MODE, PLAN_PATH, Planner, apply_plan
+from rate_limiter import TokenBucket
+from updater      import BULK_CREATE_SIZE, write_stats, log_write_stats, flush_bulk_creates, upsert_resource, delete_resource
+from state_manager import load_state, save_state, record_progress, reset_state, enter_phase, is_done, mark_done, INITIAL_STATE
+from http_session  import log_connection_stats
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
 
 API_URL     = os.getenv("ATOM_API_URL", "https://search-bcarchives.royalbcmuseum.bc.ca/api").rstrip("/")
 QUERY       = os.getenv("ATOM_INFORMATION_OBJECTS_QUERY", "sq0=GR*&sf0=referenceCode&levels=197")
-PAGE_LIMIT  = 30
-WAIT_SECONDS= int(os.getenv("ATOM_WAIT_SECONDS", "90"))
+PAGE_LIMIT  = int(os.getenv("ATOM_PAGE_LIMIT", str(INITIAL_STATE["page_limit"])))
+SYNC_MODE   = os.getenv("ATOM_SYNC_MODE", "incremental").lower()
+FULL_SYNC_INTERVAL_DAYS = int(os.getenv("ATOM_FULL_SYNC_INTERVAL_DAYS", "28"))
 
-def process_batch(skip: int, cache: dict, processed_ids: set, state: dict) -> (int, int):
-    slugs, total = fetch_slugs(skip, PAGE_LIMIT)
-    
-    if skip == 0:
-        logging.info("Total information objects to process: %s", total)
-        
-    for i, rec in enumerate(slugs, start=1):
-        slug = rec.get("slug") or rec.get("url_identifier") or rec.get("id")
-        try:
-            logging.info("Processing record %s of %s: %s", skip + i, total, slug)
-            detail = fetch_atom_detail(slug)
-            if not detail:
-                continue  # Skip processing if detail is empty
-
-            rsrc = build_resource_json(detail, slug)
-            upsert_resource(rsrc, cache)
-            processed_ids.add(rsrc["id_0"])
-
-            # Extract access points and save them to state
-            id_0 = rsrc["id_0"]
-            state.setdefault("access_points", {})[id_0] = {
-                "subject": detail.get("subject_access_points", []),
-                "place": detail.get("place_access_points", []),
-                "name": detail.get("name_access_points", []),
-                "creator": detail.get("creators", []),
-            }
-
-            # Ensure state keys are initialized as sets
-            state["unique_subjects"] = set(state.get("unique_subjects", []))
-            state["unique_places"] = set(state.get("unique_places", []))
-            state["unique_names"] = set(state.get("unique_names", []))
-
-            # Update unique sets
-            state["unique_subjects"].update(detail.get("subject_access_points", []))
-            state["unique_places"].update(detail.get("place_access_points", []))
-            state["unique_names"].update(detail.get("name_access_points", []))
-
-            # Process creators as agents
-            for creator in detail.get("creators", []):
-                creator_data = {
-                    "id_0": creator.get("authotized_form_of_name"),
-                    "dates_of_existence": [creator.get("dates_of_existence")],
-                }
-                if creator_data["id_0"]:
-                    state.setdefault("unique_names", set()).add(creator_data["id_0"])
-
-        except URLError as e:
-            logging.error("SSL or URL error while processing slug '%s': %s", slug, e)
-            continue  # Move on to the next record
-        except ssl.SSLError as e:
-            logging.error("SSL error while processing slug '%s': %s", slug, e)
-            continue  # Move on to the next record
-        except Exception as e:
-            logging.error("Error processing slug '%s': %s", slug, e)
-            continue  # Move on to the next record
-
-        if i < len(slugs):
-            time.sleep(WAIT_SECONDS)
-
-    return len(slugs), total or 0
-
-def process_access_points(state, cache):
-    # Process unique subjects
-    for subject in state.get("unique_subjects", []):
-        subject_data = {
-            "source": "local",
-            "term_type": "topical",
-            "id_0": subject,
-        }
-        try:
-            if subject in cache:
-                logging.info("Updating existing subject: %s", subject)
-                update_subject(subject_data, cache[subject])
-            else:
-                logging.info("Creating new subject: %s", subject)
-                create_subject(subject_data, cache)
-        except requests.exceptions.RequestException as e:
-            logging.error("✖ Create/Update failed for subject %s: %s", subject, e.response.json())
-
-    # Process unique places
-    for place in state.get("unique_places", []):
-        place_data = {
-            "source": "local",
-            "term_type": "geographic",
-            "id_0": place,
-        }
-        try:
-            if place in cache:
-                logging.info("Updating existing place: %s", place)
-                update_subject(place_data, cache[place])
-            else:
-                logging.info("Creating new place: %s", place)
-                create_subject(place_data, cache)
-        except requests.exceptions.RequestException as e:
-            logging.error("✖ Create/Update failed for place %s: %s", place, e.response.json())
-
-    # Process unique names
-    for name in state.get("unique_names", []):
-        agent_data = {
-            "id_0": name,
-        }
-        try:
-            if name in cache:
-                logging.info("Updating existing corporate agent: %s", name)
-                update_corporate_agent(agent_data, cache[name])
+# Pipeline stages: AtoM detail fetches run on ATOM_MAX_IN_FLIGHT workers
+MAP_WORKERS       = int(os.getenv("PIPELINE_MAP_WORKERS", "2"))
+WRITE_WORKERS     = int(os.getenv("ASPACE_WRITE_WORKERS", "2"))
+# Sustained ArchivesSpace write rate; 0 leaves writes unthrottled
+WRITES_PER_SECOND = float(os.getenv("ASPACE_WRITES_PER_SECOND", "0"))
+# Records buffered between two stages before the upstream stage blocks
+QUEUE_SIZE        = int(os.getenv("PIPELINE_QUEUE_SIZE", "60"))
+
+write_limiter = TokenBucket(WRITES_PER_SECOND, WRITE_WORKERS) if WRITES_PER_SECOND > 0 else None
+
+def choose_sync_mode(state: dict) -> str:
+    """Run incrementally from the watermark unless a full reconcile is requested or due."""
+    if SYNC_MODE == "full" or not state.get("watermark") or not state.get("last_full_sync"):
+        return "full"
+    last_full = datetime.fromisoformat(state["last_full_sync"])
+    if datetime.now(timezone.utc) - last_full >= timedelta(days=FULL_SYNC_INTERVAL_DAYS):
+        return "full"
+    return "incremental"
+
+class SyncItem:
+    """One AtoM record on its way through the fetch, map and write stages."""
+
+    __slots__ = ("skip", "position", "total", "slug", "fetched", "id_0", "rsrc", "linked")
+
+    def __init__(self, skip: int, position: int, total: int, slug: str):
+        self.skip = skip
+        self.position = position
+        self.total = total
+        self.slug = slug
+        self.fetched = None
+        self.id_0 = None
+        self.rsrc = None
+        # False when an inline link could not be resolved; the detail is then not remembered
+        self.linked = True
+
+def fetch_stage(item: SyncItem) -> SyncItem:
+    logging.info("Processing record %s of %s: %s", item.position, item.total, item.slug)
+    item.fetched = fetch_atom_detail(item.slug)
+    return item
+
+def map_stage(index: ArchivesSpaceIndex, resolver: AuthorityResolver | None, item: SyncItem) -> SyncItem:
+    detail = item.fetched.detail
+    if not detail:
+        return item  # Skip processing if detail is empty
+
+    item.id_0 = detail.get("reference_code", "Unknown")
+    if not item.fetched.changed and item.id_0 in index.resources:
+        # Same payload as the last successful write, so mapping and upserting can be skipped
+        logging.info("Unchanged since last sync: %s", item.slug)
+        return item
+
+    rsrc = build_resource_json(detail, item.slug)
+    item.id_0 = rsrc["id_0"]
+    if resolver:
+        # Resolve links first so the resource is written once, already linked
+        links = resolver.links(
+            detail.get("subject_access_points", []),
+            detail.get("place_access_points", []),
+            detail.get("name_access_points", []),
+            [creator.get("authotized_form_of_name") for creator in detail.get("creators", [])],
+        )
+        rsrc["subjects"], rsrc["linked_agents"] = links.subjects, links.linked_agents
+        if links.unresolved:
+            # Written without those links; an unchanged detail would skip the record until AtoM changes it
+            logging.warning("Unresolved access points for %s: %s; it will be written again next run", item.slug, ", ".join(links.unresolved))
+            item.linked = False
+    item.rsrc = rsrc
+    return item
+
+def write_stage(index: ArchivesSpaceIndex, item: SyncItem) -> SyncItem:
+    if item.rsrc is not None:
+        # The detail is only remembered once ArchivesSpace holds the record, which for a
+        # batch-imported resource is when its batch is flushed
+        upsert_resource(item.rsrc, index.resources, partial(remember_detail, item.slug, item.fetched) if item.linked else None)
+    return item
+
+def access_point_terms(detail: dict) -> dict:
+    """Access point terms of an AtoM detail record by role; creators are names in the "creator" role."""
+    return {
+        "subject": detail.get("subject_access_points", []),
+        "place": detail.get("place_access_points", []),
+        "name": detail.get("name_access_points", []),
+        "creator": [creator.get("authotized_form_of_name") for creator in detail.get("creators", [])],
+    }
+
+def record_access_points(state: dict, id_0: str, detail: dict) -> None:
+    # Register access points with the shared registry
+    record_progress(state, id_0, access_point_terms(detail))
+
+def sync_resources(state: dict, index: ArchivesSpaceIndex, processed_ids: set, updated_since: str | None,
+                   resolver: AuthorityResolver | None = None) -> None:
+    """Run every listed record through the fetch → map → write pipeline.
+
+    ``state["skip"]`` only moves past a page once all of its records, and every earlier
+    page's, have been written. Each finished record is also marked done, so a restart
+    resumes the page it stopped in without fetching or writing those records again.
+    """
+    page_limit = state["page_limit"]
+    tracker = PageTracker()
+
+    def listed_records():
+        # Pages are read ahead in the background while earlier records move through the stages
+        for skip, slugs, total in prefetch_slug_pages(state["skip"], page_limit, updated_since):
+            if skip == 0:
+                logging.info("Total information objects to process: %s", total)
             else:
-                logging.info("Creating new corporate agent: %s", name)
-                create_corporate_agent(agent_data, cache)
-        except requests.exceptions.RequestException as e:
-            logging.error("✖ Create/Update failed for corporate agent %s: %s", name, e.response.json())
-
-    # Update resources to link subjects and agents
-    for resource_id, access_points in state.get("access_points", {}).items():
-        resource_meta = cache.get(resource_id)
-        if not resource_meta:
-            logging.warning("Resource ID %s not found in cache. Skipping.", resource_id)
-            continue
-
-        linked_subjects = [
-            {"ref": cache[sub]["uri"]} for sub in access_points.get("subject", []) if sub in cache
-        ]
-        linked_places = [
-            {"ref": cache[place]["uri"]} for place in access_points.get("place", []) if place in cache
-        ]
-        linked_agents = [
-            {"ref": cache[name]["uri"], "role": "subject"} for name in access_points.get("name", []) if name in cache
-        ]
-
-        # Add creators with role "subject" and only the first creator with role "creator"
-        linked_creators = []
-        for idx, creator in enumerate(access_points.get("creator", [])):
-            creator_id = creator.get("authotized_form_of_name")  # Corrected key
-            if creator_id in cache:
-                if idx == 0:  # Add only the first creator with role "creator"
-                    linked_creators.append({"ref": cache[creator_id]["uri"], "role": "creator"})
-                else:
-                    linked_creators.append({"ref": cache[creator_id]["uri"], "role": "subject"})
-
-        # Update only the necessary fields while preserving existing properties
-        resource_update = {
-            "id_0": resource_id,
-            "subjects": linked_subjects + linked_places,
-            "linked_agents": linked_agents + linked_creators,
-        }
+                logging.info("Batch %s → skipping %s", page_limit, skip)
+            keys = [rec.get("slug") or rec.get("url_identifier") or rec.get("id") for rec in slugs]
+            # Records finished before a restart are not fetched again
+            todo = [(i, key) for i, key in enumerate(keys, start=1) if not is_done(state, key)]
+            tracker.open(skip, len(slugs), total, pending=len(todo))
+            for i, key in todo:
+                yield SyncItem(skip, skip + i, total, key)
+
+    def checkpoint() -> None:
+        pages = tracker.completed()
+        if not pages:
+            # Journal the finished record; with batch imports it may still be queued, so wait for the page
+            if not BULK_CREATE_SIZE:
+                save_state(state)
+            return
+        # Queued creates must exist before the pages holding them are marked done
+        flush_bulk_creates()
+        skip, size, total = pages[-1]
+        state["total"] = total
+        state["skip"] = skip + size
+        save_state(state)
+        logging.info("Processed %s records.", state["skip"])
 
+    pipeline = Pipeline(listed_records(), [
+        Stage("fetch", fetch_stage, MAX_IN_FLIGHT),
+        Stage("map", partial(map_stage, index, resolver), MAP_WORKERS),
+        Stage("write", partial(write_stage, index), WRITE_WORKERS, write_limiter),
+    ], QUEUE_SIZE)
+
+    for item, error in pipeline.run():
         try:
-            logging.info("Updating resource %s with linked subjects and agents.", resource_id)
-            update_resource(resource_update, resource_meta)
-        except requests.exceptions.RequestException as e:
-            logging.error("✖ Update failed for resource %s: %s", resource_id, e.response.json())
+            if isinstance(error, URLError):
+                logging.error("SSL or URL error while processing slug '%s': %s", item.slug, error)
+            elif isinstance(error, ssl.SSLError):
+                logging.error("SSL error while processing slug '%s': %s", item.slug, error)
+            elif error is not None:
+                logging.error("Error processing slug '%s': %s", item.slug, error)
+            elif item.fetched.failed:
+                # The record was not seen, so this run must not decide it is gone from AtoM
+                state["fetch_failures"] += 1
+            elif item.fetched.detail:
+                processed_ids.add(item.id_0)
+                record_access_points(state, item.id_0, item.fetched.detail)
+                run_metrics.count_records("resources")
+        except Exception as e:
+            logging.error("Error processing slug '%s': %s", item.slug, e)
+        mark_done(state, item.slug)
+        tracker.done(item.skip)
+        checkpoint()
+
+    # Trailing empty pages have no records to complete them
+    checkpoint()
+    pipeline.log_stats()
+
+def plan_sync(index: ArchivesSpaceIndex, mode: str, updated_since: str | None) -> None:
+    """Fetch and map every listed record as a run would, and write the resulting plan instead of syncing."""
+    planner = Planner(index, PLAN_PATH, "atom", mode)
+    listed = {"records": 0, "total": None, "failed": 0}
+
+    def listed_records():
+        for skip, slugs, total in prefetch_slug_pages(0, PAGE_LIMIT, updated_since):
+            listed["records"], listed["total"] = skip + len(slugs), total
+            for i, rec in enumerate(slugs, start=1):
+                yield SyncItem(skip, skip + i, total, rec.get("slug") or rec.get("url_identifier") or rec.get("id"))
+
+    pipeline = Pipeline(listed_records(), [
+        Stage("fetch", fetch_stage, MAX_IN_FLIGHT),
+        Stage("map", partial(map_stage, index, None), MAP_WORKERS),
+    ], QUEUE_SIZE)
+    for item, error in pipeline.run():
+        if error is not None:
+            logging.error("Error planning slug '%s': %s", item.slug, error)
+        elif item.fetched.failed:
+            listed["failed"] += 1
+        elif item.fetched.detail:
+            planner.resource(item.id_0, item.rsrc, access_point_terms(item.fetched.detail))
+            run_metrics.count_records("plan")
+    pipeline.log_stats()
+
+    planner.authorities()
+    planner.links()
+    if mode == "full":
+        if listed["total"] is None or listed["records"] < listed["total"]:
+            logging.warning("Listing stopped at %s of %s records; deletions left out of the plan.", listed["records"], listed["total"])
+        elif listed["failed"]:
+            logging.warning("%s AtoM details could not be fetched; deletions left out of the plan.", listed["failed"])
+        else:
+            planner.deletions()
+    planner.close(WRITES_PER_SECOND)
 
 def main():
     state = load_state()
-    cache = load_existing_resources()
+    evict_expired_details()
 
-    # Load existing subjects and agents into the cache
-    cache.update(load_existing_subjects())
-    cache.update(load_existing_agents())
+    if PLAN_MODE == "apply":
+        with run_metrics.phase("index"):
+            index = load_existing_index()
+        with run_metrics.phase("apply"):
+            apply_plan(PLAN_PATH, index)
+        log_write_stats()
+        log_connection_stats()
+        run_metrics.export(write_stats)
+        return
+    if PLAN_MODE == "plan":
+        # Planning reads AtoM and ArchivesSpace only; state.json is left as it is
+        mode = state.get("mode") or choose_sync_mode(state)
+        with run_metrics.phase("index"):
+            index = load_existing_index()
+        with run_metrics.phase("plan"):
+            plan_sync(index, mode, state["watermark"] if mode == "incremental" else None)
+        log_connection_stats()
+        log_retry_metrics()
+        run_metrics.export(write_stats)
+        return
 
-    processed_ids = set()
+    # A resumed run keeps the mode and start time it was started with
+    if state.get("mode") is None:
+        state["mode"] = choose_sync_mode(state)
+        state["run_started"] = datetime.now(timezone.utc).isoformat()
+    if state["mode"] == "incremental":
+        logging.info("Incremental sync of records updated since %s", state["watermark"])
+    else:
+        logging.info("Full reconcile of all information objects")
 
-    # Ensure 'total' is initialized in the state
-    if state.get("total") is None:
-        state["total"] = float('inf')
+    # Phases run in order: index, resources, authorities, linking, deletion. A restarted run
+    # continues in the phase it stopped in and skips the items that phase already finished.
+    if state.get("phase") is None:
+        enter_phase(state, "index")
+    else:
+        logging.info("Resuming the %s phase with %s items already done", state["phase"], len(state.get("done", ())))
 
-    while state["skip"] < state.get("total"):  # Continue until all batches are processed
-        try:
-            if state["skip"] == 0:  # Set total on first batch
-                processed, total = process_batch(state["skip"], cache, processed_ids, state)
-                state["total"] = total
-            else:
-                logging.info("Batch %s → skipping %s", PAGE_LIMIT, state["skip"])
-                processed, _ = process_batch(state["skip"], cache, processed_ids, state)
+    # Resources, subjects and agents are indexed in separate namespaces; the store refreshes
+    # incrementally, so reloading it on resume only fetches what changed meanwhile
+    with run_metrics.phase("index"):
+        index = load_existing_index()
+    if state["phase"] == "index":
+        enter_phase(state, "resources")
+
+    # Records synced before a restart count as processed too
+    processed_ids = set(state["access_points"].resource_ids())
+    resolver = AuthorityResolver(index) if LINK_MODE == "inline" else None
 
-            state["skip"] += processed
+    if state["phase"] == "resources":
+        state["page_limit"] = PAGE_LIMIT
+        updated_since = state["watermark"] if state["mode"] == "incremental" else None
+        with run_metrics.phase("resources"):
+            sync_resources(state, index, processed_ids, updated_since, resolver)
+
+            # Create whatever is still queued for a batch import
+            flush_bulk_creates()
             save_state(state)
 
-            logging.info("Processed %s records.", state["skip"])
-        except Exception as e:
-            logging.error("An error occurred in the main loop: %s", e)
-            continue
+        # The page producer stops early when AtoM cannot be reached; keep the state so the next run resumes
+        if state.get("total") is None or state["skip"] < state["total"]:
+            logging.warning("Listing stopped at %s of %s records; skipping deletion and keeping state.", state["skip"], state.get("total"))
+            log_write_stats()
+            log_connection_stats()
+            log_retry_metrics()
+            run_metrics.export(write_stats)
+            return
+        # Inline mode has already linked every resource to its authorities
+        enter_phase(state, "authorities" if resolver is None else "deletion")
+
+    if state["phase"] == "authorities":
+        with run_metrics.phase("authorities"):
+            process_authorities(state, index)
+        enter_phase(state, "linking")
+
+    if state["phase"] == "linking":
+        with run_metrics.phase("linking"):
+            link_resources(state, index)
+        enter_phase(state, "deletion")
 
-    # Call process_access_points after processing resources
-    process_access_points(state, cache)
+    # Records whose detail could not be fetched would look unused, and an incremental run from a
+    # new watermark would not list them again, so such a run neither deletes nor moves the watermark
+    if state["fetch_failures"]:
+        logging.warning("%s AtoM details could not be fetched; skipping deletion and keeping the watermark.", state["fetch_failures"])
+    else:
+        # Delete unused resources; an incremental run only sees changed records, so only a full reconcile may delete.
+        # Deletions write through to the index store, so a restart only sees what is left to delete
+        if state["mode"] == "full":
+            with run_metrics.phase("deletion"):
+                delete_unused(index.resources, processed_ids, delete_resource)
+            state["last_full_sync"] = state["run_started"]
 
-    # Delete unused resources
-    unused_ids = set(cache.keys()) - processed_ids
-    for unused_id in unused_ids:
-        time.sleep(WAIT_SECONDS)
-        delete_resource(cache[unused_id])
-        del cache[unused_id]
+        # Everything updated before this run started has now been synced
+        state["watermark"] = state["run_started"]
 
     # Reset state back to initial defaults
-    reset_state()
+    reset_state(state)
     logging.info("state.json has been reset to initial values.")
+    log_write_stats()
+    log_connection_stats()
+    log_retry_metrics()
+    run_metrics.export(write_stats)
     
 
 if __name__ == "__main__":
-    main()
+    run_profiled(main)
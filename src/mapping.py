@@ -2,6 +2,8 @@ import re
 from typing import Any, Dict, List, Optional
 from datetime import datetime
 
+from profiling import span
+
 ALLOWED_SINGLEPART = {"abstract", "materialspec", "physdesc", "physfacet", "physloc"}
 
 def build_extents(extent_str: str) -> List[Dict[str, str]]:
@@ -45,6 +47,7 @@ def make_note(note_type: str, content: str | None) -> Optional[Dict[str, Any]]:
         ],
     }
 
+@span("map")
 def build_resource_json(d: Dict[str, Any], slug: str) -> Dict[str, Any]:
     """Transform a full ATOM detail record into an ArchivesSpace resource JSON."""
     notes = [
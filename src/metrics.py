@@ -0,0 +1,187 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Tuple
+from urllib.parse import urlsplit
+
+# Prometheus text-format file written at the end of every run (e.g. for node_exporter's textfile collector)
+METRICS_PROM_PATH = os.getenv("METRICS_PROM_PATH", "metrics.prom")
+# JSON summary of the same run; either path may be set to "" to skip that file
+METRICS_SUMMARY_PATH = os.getenv("METRICS_SUMMARY_PATH", "metrics_summary.json")
+
+# Upper bounds, in seconds, of the HTTP latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Record ids and AtoM slugs are collapsed so each endpoint is one series
+_NUMERIC_SEGMENT = re.compile(r"/\d+(?=/|$)")
+_SLUG_SEGMENT = re.compile(r"(/informationobjects)/[^/]+")
+
+def endpoint_template(url: str) -> str:
+    """The path of ``url`` with ids and slugs replaced, e.g. ``/repositories/:id/resources/:id``."""
+    path = _NUMERIC_SEGMENT.sub("/:id", urlsplit(url).path)
+    return _SLUG_SEGMENT.sub(r"\1/:slug", path) or "/"
+
+class EndpointStats:
+    """Request count, status codes and latency histogram of one endpoint."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.statuses: Counter = Counter()
+
+    def observe(self, status: str, seconds: float) -> None:
+        self.count += 1
+        self.seconds += seconds
+        self.statuses[status] += 1
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the ``q`` quantile; None when it is above the last bucket."""
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            if count >= q * self.count:
+                return bound
+        return None
+
+class RunMetrics:
+    """Thread-safe timings and counters of one sync run.
+
+    Sleep and request times are summed over threads, so with concurrent workers they can
+    exceed the wall time; compare them with each other rather than with the run length.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.phases: Dict[str, float] = {}
+        self.records: Counter = Counter()
+        self.sleeps: Counter = Counter()
+        self.requests: Dict[Tuple[str, str, str], EndpointStats] = defaultdict(EndpointStats)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Add the wall time of the ``with`` block to phase ``name``."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + time.monotonic() - started
+
+    def count_records(self, phase: str, n: int = 1) -> None:
+        with self._lock:
+            self.records[phase] += n
+
+    def add_sleep(self, reason: str, seconds: float) -> None:
+        with self._lock:
+            self.sleeps[reason] += seconds
+
+    def sleep(self, seconds: float, reason: str) -> None:
+        """``time.sleep`` that is accounted as deliberate waiting rather than work."""
+        started = time.monotonic()
+        time.sleep(seconds)
+        self.add_sleep(reason, time.monotonic() - started)
+
+    def observe_request(self, service: str, method: str, url: str, status: str, seconds: float) -> None:
+        with self._lock:
+            self.requests[service, method, endpoint_template(url)].observe(status, seconds)
+
+    def summary(self, writes: Optional[Mapping[Tuple[str, str], int]] = None) -> Dict[str, Any]:
+        with self._lock:
+            wall = time.monotonic() - self.started
+            request_seconds = sum(stats.seconds for stats in self.requests.values())
+            return {
+                "finished": datetime.now(timezone.utc).isoformat(),
+                "wall_seconds": round(wall, 3),
+                "phases": {
+                    name: {
+                        "seconds": round(seconds, 3),
+                        "records": self.records[name],
+                        "records_per_second": round(self.records[name] / seconds, 3) if seconds else 0.0,
+                    }
+                    for name, seconds in self.phases.items()
+                },
+                "sleep_seconds": {reason: round(seconds, 3) for reason, seconds in sorted(self.sleeps.items())},
+                "request_seconds": round(request_seconds, 3),
+                "requests": [
+                    {
+                        "service": service, "method": method, "endpoint": endpoint, "count": stats.count,
+                        "mean_seconds": round(stats.seconds / stats.count, 4) if stats.count else 0.0,
+                        "p50_seconds": stats.quantile(0.5), "p95_seconds": stats.quantile(0.95),
+                        "statuses": dict(sorted(stats.statuses.items())),
+                    }
+                    for (service, method, endpoint), stats in sorted(self.requests.items())
+                ],
+                "writes": {f"{kind} {outcome}": count for (kind, outcome), count in sorted((writes or {}).items())},
+            }
+
+    def prometheus(self, writes: Optional[Mapping[Tuple[str, str], int]] = None) -> str:
+        lines: List[str] = []
+
+        def metric(name: str, kind: str, help_text: str, samples: List[Tuple[str, Dict[str, str], float]]) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, labels, value in samples:
+                label_text = ",".join(f'{key}="{_escape(str(val))}"' for key, val in labels.items())
+                lines.append(f"{name}{suffix}{{{label_text}}} {value:g}" if label_text else f"{name}{suffix} {value:g}")
+
+        with self._lock:
+            metric("sync_run_seconds", "gauge", "Wall time of the sync run.",
+                   [("", {}, time.monotonic() - self.started)])
+            metric("sync_phase_seconds", "gauge", "Wall time spent in each phase.",
+                   [("", {"phase": name}, seconds) for name, seconds in sorted(self.phases.items())])
+            metric("sync_records_total", "counter", "Records processed in each phase.",
+                   [("", {"phase": name}, count) for name, count in sorted(self.records.items())])
+            metric("sync_sleep_seconds_total", "counter", "Time spent in deliberate waits, summed over threads.",
+                   [("", {"reason": reason}, seconds) for reason, seconds in sorted(self.sleeps.items())])
+
+            histogram, responses = [], []
+            for (service, method, endpoint), stats in sorted(self.requests.items()):
+                labels = {"service": service, "method": method, "endpoint": endpoint}
+                histogram += [("_bucket", {**labels, "le": f"{bound:g}"}, count)
+                              for bound, count in zip(LATENCY_BUCKETS, stats.buckets)]
+                histogram += [("_bucket", {**labels, "le": "+Inf"}, stats.count),
+                              ("_sum", labels, stats.seconds), ("_count", labels, stats.count)]
+                responses += [("", {**labels, "status": status}, count) for status, count in sorted(stats.statuses.items())]
+            metric("sync_http_request_duration_seconds", "histogram", "Latency of HTTP requests per endpoint.", histogram)
+            metric("sync_http_responses_total", "counter", "HTTP responses per endpoint and status code.", responses)
+
+        metric("sync_writes_total", "counter", "ArchivesSpace writes per record kind and outcome.",
+               [("", {"kind": kind, "outcome": outcome}, count) for (kind, outcome), count in sorted((writes or {}).items())])
+        return "\n".join(lines) + "\n"
+
+    def export(self, writes: Optional[Mapping[Tuple[str, str], int]] = None) -> None:
+        """Log the phase timings and write METRICS_PROM_PATH and METRICS_SUMMARY_PATH."""
+        summary = self.summary(writes)
+        for name, phase in summary["phases"].items():
+            logging.info("Phase %s: %.1fs, %s records, %.2f records/s",
+                         name, phase["seconds"], phase["records"], phase["records_per_second"])
+        logging.info("Run took %.1fs; %.1fs in HTTP requests and %.1fs in deliberate waits, summed over threads",
+                     summary["wall_seconds"], summary["request_seconds"], sum(summary["sleep_seconds"].values()))
+        if METRICS_PROM_PATH:
+            _write_atomic(METRICS_PROM_PATH, self.prometheus(writes))
+        if METRICS_SUMMARY_PATH:
+            _write_atomic(METRICS_SUMMARY_PATH, json.dumps(summary, indent=2))
+        if paths := [path for path in (METRICS_PROM_PATH, METRICS_SUMMARY_PATH) if path]:
+            logging.info("Metrics written to %s", ", ".join(paths))
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _write_atomic(path: str, text: str) -> None:
+    # Collectors reading the file mid-write would see a partial exposition
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+# Shared by every module of a run
+run_metrics = RunMetrics()
@@ -0,0 +1,200 @@
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple
+
+from rate_limiter import TokenBucket
+
+_DONE = object()
+
+class StageStats:
+    """Throughput, busy time and back-pressure counters for one stage."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.items = 0
+        self.errors = 0
+        self.busy = 0.0       # seconds spent in the stage function, summed over workers
+        self.starved = 0.0    # seconds workers waited for input
+        self.blocked = 0.0    # seconds workers waited for room downstream
+        self.max_depth = 0
+        self._depth_total = 0
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+
+    def sample_depth(self, depth: int) -> None:
+        with self._lock:
+            self._depth_total += depth
+            self.max_depth = max(self.max_depth, depth)
+
+    def add(self, busy: float, starved: float, blocked: float, failed: bool) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self.items += 1
+            self.errors += failed
+            self.busy += busy
+            self.starved += starved
+            self.blocked += blocked
+            self.started = self.started or now - busy - starved
+            self.finished = now
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished - self.started) if self.started and self.finished else 0.0
+
+    @property
+    def avg_depth(self) -> float:
+        return self._depth_total / self.items if self.items else 0.0
+
+class Stage:
+    """One pipeline step run by ``workers`` threads, optionally throttled by ``limiter``.
+
+    ``fn`` receives an item and returns the item to hand to the next stage.
+    """
+
+    def __init__(self, name: str, fn: Callable[[Any], Any], workers: int = 1, limiter: Optional[TokenBucket] = None):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.limiter = limiter
+        self.stats = StageStats()
+
+class Pipeline:
+    """Runs ``source`` through ``stages`` connected by bounded queues.
+
+    Every stage works concurrently with the others, and a full queue blocks the stage feeding
+    it, so a slow stage throttles everything upstream instead of letting items pile up in
+    memory. ``run`` yields ``(item, error)`` pairs in completion order; an item that raised
+    in one stage skips the remaining stages and arrives with the exception.
+    """
+
+    def __init__(self, source: Iterable[Any], stages: List[Stage], queue_size: int):
+        self.source = source
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize=max(1, queue_size)) for _ in range(len(stages) + 1)]
+        self._stop = threading.Event()
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _feed(self) -> None:
+        try:
+            for item in self.source:
+                if not self._put(self.queues[0], (item, None)):
+                    return
+        except Exception as e:
+            logging.error("Pipeline source stopped: %s", e)
+        finally:
+            self._put(self.queues[0], _DONE)
+
+    def _work(self, stage: Stage, inbox: queue.Queue, outbox: queue.Queue, remaining: List[int],
+              lock: threading.Lock) -> None:
+        while True:
+            waited = time.monotonic()
+            stage.stats.sample_depth(inbox.qsize())
+            entry = self._get(inbox)
+            if entry is _DONE:
+                # Let sibling workers see the end too; the last one passes it downstream
+                with lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                self._put(outbox if last else inbox, _DONE)
+                return
+            started = time.monotonic()
+            item, error = entry
+            failed = False
+            if error is None:
+                try:
+                    if stage.limiter:
+                        stage.limiter.acquire()
+                    item = stage.fn(item)
+                except Exception as e:
+                    error, failed = e, True
+            finished = time.monotonic()
+            if not self._put(outbox, (item, error)):
+                return
+            stage.stats.add(finished - started, started - waited, time.monotonic() - finished, failed)
+
+    def run(self) -> Iterator[Tuple[Any, Optional[Exception]]]:
+        threads = [threading.Thread(target=self._feed, name="pipeline-source", daemon=True)]
+        for stage, inbox, outbox in zip(self.stages, self.queues, self.queues[1:]):
+            remaining, lock = [stage.workers], threading.Lock()
+            threads += [
+                threading.Thread(target=self._work, args=(stage, inbox, outbox, remaining, lock),
+                                 name=f"pipeline-{stage.name}-{n}", daemon=True)
+                for n in range(stage.workers)
+            ]
+        for thread in threads:
+            thread.start()
+        try:
+            while (entry := self._get(self.queues[-1])) is not _DONE:
+                yield entry
+        finally:
+            # Daemon workers notice this within a second and exit
+            self._stop.set()
+
+    def log_stats(self) -> None:
+        """Log per-stage throughput and queue depth; the busiest stage is the bottleneck."""
+        for stage in self.stages:
+            s = stage.stats
+            logging.info(
+                "Stage %s: %s items (%s failed) in %.1fs, %.2f/s; %s workers busy %.1fs, "
+                "waiting for input %.1fs, blocked on output %.1fs; input queue avg %.1f, max %s",
+                stage.name, s.items, s.errors, s.elapsed, s.items / s.elapsed if s.elapsed else 0.0,
+                stage.workers, s.busy, s.starved, s.blocked, s.avg_depth, s.max_depth,
+            )
+        utilisation = {
+            stage.name: stage.stats.busy / (stage.workers * stage.stats.elapsed)
+            for stage in self.stages if stage.stats.elapsed
+        }
+        if utilisation:
+            busiest = max(utilisation, key=utilisation.get)
+            logging.info("Busiest stage: %s (%.0f%% of worker time busy)", busiest, 100 * utilisation[busiest])
+
+class PageTracker:
+    """Tracks listing pages whose records are all through the pipeline, in listing order.
+
+    Records finish out of order, so a page only counts as done once it and every page
+    before it have no records left in flight.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pages: "OrderedDict[int, list]" = OrderedDict()
+
+    def open(self, skip: int, size: int, total: int, pending: int | None = None) -> None:
+        """Track a page of ``size`` records, of which ``pending`` (default all) still go through the pipeline."""
+        with self._lock:
+            self._pages[skip] = [size if pending is None else pending, size, total]
+
+    def done(self, skip: int) -> None:
+        with self._lock:
+            self._pages[skip][0] -= 1
+
+    def completed(self) -> List[Tuple[int, int, int]]:
+        """Pop and return ``(skip, size, total)`` for every leading page with nothing left in flight."""
+        finished = []
+        with self._lock:
+            while self._pages:
+                skip, (left, size, total) = next(iter(self._pages.items()))
+                if left > 0:
+                    break
+                del self._pages[skip]
+                finished.append((skip, size, total))
+        return finished
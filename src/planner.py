@@ -0,0 +1,165 @@
+import json
+import logging
+import os
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from access_points import AccessPointRegistry
+from aspace_index import ArchivesSpaceIndex
+from authority_sync import resource_links, subject_term_types
+from deletion import MAX_DELETE_FRACTION, delete_entries, select_unused
+from record_diff import has_changes
+from updater import (
+    create_corporate_agent, create_subject, delete_resource, flush_bulk_creates, subject_changes, update_resource,
+    update_subject, upsert_resource,
+)
+
+# "plan" computes what a run would change and writes it to PLAN_PATH without writing to ArchivesSpace;
+# "apply" executes a plan written earlier
+PLAN_MODE = os.getenv("SYNC_PLAN_MODE", "").lower()
+PLAN_PATH = os.getenv("SYNC_PLAN_PATH", "sync_plan.jsonl")
+
+class Planner:
+    """Works out the creates, updates, links and deletions a sync would make, and writes them as a plan.
+
+    The plan is a JSON-lines file: a header, one line per action in the order ``apply_plan``
+    runs them, and a closing summary. Records that would not change are only counted.
+    """
+
+    def __init__(self, index: ArchivesSpaceIndex, path: str, source: str, mode: str):
+        self.index = index
+        self.path = path
+        self.counts: Counter = Counter()
+        self.registry = AccessPointRegistry()
+        self.seen: set = set()
+        self._file = open(path, "w")
+        self._write({"plan": {"created": datetime.now(timezone.utc).isoformat(), "source": source, "mode": mode}})
+
+    def _write(self, line: Dict[str, Any]) -> None:
+        self._file.write(json.dumps(line) + "\n")
+
+    def _action(self, action: str, kind: str, id_0: str, **fields) -> None:
+        self.counts[kind, action] += 1
+        self._write({"action": action, "kind": kind, "id_0": id_0, **fields})
+
+    def resource(self, id_0: str, rsrc: Optional[Dict[str, Any]], terms: Optional[Dict[str, Iterable[str]]] = None) -> None:
+        """Plan one mapped resource; ``rsrc`` is None when its source record is known to be unchanged."""
+        self.seen.add(id_0)
+        if terms is not None:
+            self.registry.add(id_0, terms)
+        entry = self.index.resources.get(id_0)
+        if entry is None and rsrc is not None:
+            self._action("create", "resource", id_0, payload=rsrc)
+            return
+        existing = self.index.resources.record(entry) if entry is not None and rsrc is not None else None
+        if rsrc is None or (existing is not None and not has_changes(existing, rsrc)):
+            self.counts["resource", "unchanged"] += 1
+        else:
+            self._action("update", "resource", id_0, payload=rsrc)
+
+    def authorities(self) -> None:
+        for term, term_type in subject_term_types(self.registry).items():
+            subject = {"source": "local", "term_type": term_type, "id_0": term}
+            if (entry := self.index.subjects.get(term)) is None:
+                self._action("create", "subject", term, term_type=term_type)
+            elif (existing := self.index.subjects.record(entry)) is not None and not has_changes(existing, subject_changes(subject, existing)):
+                self.counts["subject", "unchanged"] += 1
+            else:
+                self._action("update", "subject", term, term_type=term_type)
+        for name in self.registry.terms("name"):
+            if name in self.index.agents:
+                self.counts["corporate agent", "unchanged"] += 1
+            else:
+                self._action("create", "corporate agent", name)
+
+    def links(self) -> None:
+        for id_0, access_points in self.registry.records():
+            if not any(access_points.values()):
+                continue
+            entry = self.index.resources.get(id_0)
+            existing = self.index.resources.record(entry) if entry is not None else None
+            resolvable = all(
+                term in (self.index.agents if role in ("name", "creator") else self.index.subjects)
+                for role, terms in access_points.items() for term in terms
+            )
+            # Links to authorities that do not exist yet always change the resource
+            if existing is not None and resolvable and not has_changes(existing, resource_links(id_0, access_points, self.index)):
+                self.counts["resource", "links unchanged"] += 1
+            else:
+                self._action("link", "resource", id_0, access_points=access_points)
+
+    def deletions(self) -> None:
+        unused = select_unused(self.index.resources, self.seen)
+        for entry in sorted(unused, key=lambda e: e.key):
+            self._action("delete", "resource", entry.key, uri=entry.uri)
+        if len(unused) > MAX_DELETE_FRACTION * len(self.index.resources):
+            logging.warning(
+                "Plan deletes %s of %s resources, more than ASPACE_MAX_DELETE_FRACTION=%s; applying it would delete nothing.",
+                len(unused), len(self.index.resources), MAX_DELETE_FRACTION,
+            )
+
+    def close(self, writes_per_second: float = 0) -> Dict[str, int]:
+        """Write the summary line, log it and return the counts."""
+        summary = {f"{kind} {action}": count for (kind, action), count in sorted(self.counts.items())}
+        self._write({"summary": summary})
+        self._file.close()
+        for key, count in summary.items():
+            logging.info("Plan: %s %s", count, key)
+        writes = sum(count for (kind, action), count in self.counts.items() if "unchanged" not in action)
+        if writes_per_second > 0:
+            logging.info("Plan: %s ArchivesSpace writes, about %.1f minutes at %s writes/s",
+                         writes, writes / writes_per_second / 60, writes_per_second)
+        else:
+            logging.info("Plan: %s ArchivesSpace writes", writes)
+        logging.info("Plan written to %s", self.path)
+        return summary
+
+def read_plan(path: str) -> Iterable[Dict[str, Any]]:
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def apply_plan(path: str, index: ArchivesSpaceIndex) -> None:
+    """Execute the actions of a plan file in order, against the current index.
+
+    Updates still go through the lock_version and change checks of ``updater``, so records
+    edited since the plan was written are merged rather than overwritten. Deletions keep
+    the safety cap.
+    """
+    flushed = False
+    deletes: List = []
+    for line in read_plan(path):
+        if "plan" in line:
+            logging.info("Applying plan created %s from %s (%s)", line["plan"]["created"], line["plan"]["source"], line["plan"]["mode"])
+        if "action" not in line:
+            continue
+        action, kind, id_0 = line["action"], line["kind"], line["id_0"]
+        if action in ("link", "delete") and not flushed:
+            # Authorities and resources queued for a batch import need URIs before links and deletions
+            flush_bulk_creates()
+            flushed = True
+
+        if kind == "resource" and action in ("create", "update"):
+            upsert_resource(line["payload"], index.resources)
+        elif kind == "resource" and action == "link":
+            if (entry := index.resources.get(id_0)) is not None:
+                update_resource(resource_links(id_0, line["access_points"], index), entry, index.resources)
+            else:
+                logging.warning("Resource ID %s not found in the index. Skipping.", id_0)
+        elif kind == "resource" and action == "delete":
+            # Skip records recreated or renumbered since the plan was written
+            if (entry := index.resources.get(id_0)) is not None and entry.uri == line["uri"]:
+                deletes.append(entry)
+        elif kind == "subject":
+            subject = {"source": "local", "term_type": line["term_type"], "id_0": id_0}
+            if (entry := index.subjects.get(id_0)) is not None:
+                update_subject(subject, entry, index.subjects)
+            else:
+                create_subject(subject, index.subjects)
+        elif kind == "corporate agent" and id_0 not in index.agents:
+            create_corporate_agent({"id_0": id_0}, index.agents)
+
+    flush_bulk_creates()
+    delete_entries(index.resources, deletes, delete_resource)
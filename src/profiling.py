@@ -0,0 +1,155 @@
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Any, Callable, Dict, List, TypeVar
+
+from metrics import RunMetrics
+
+T = TypeVar("T")
+
+# Directory the profile is written to; profiling is off while this is empty
+PROFILE_DIR = os.getenv("SYNC_PROFILE_DIR", "")
+# Milliseconds between stack samples for the collapsed-stack (flame graph) output
+PROFILE_INTERVAL_MS = float(os.getenv("SYNC_PROFILE_INTERVAL_MS", "10"))
+
+_lock = threading.Lock()
+# span name → [calls, wall seconds, thread CPU seconds]
+_spans: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0, 0.0])
+_span_codes: Dict[Any, str] = {}
+
+def span(name: str) -> Callable[[Callable[..., T]], Callable[..., T]]:
+    """Tag a hot-path function: its calls, wall time and CPU time are reported as span ``name``.
+
+    Functions are returned unwrapped when profiling is off, so tagging costs nothing in normal runs.
+    """
+    def decorate(fn: Callable[..., T]) -> Callable[..., T]:
+        if not PROFILE_DIR:
+            return fn
+        _span_codes[fn.__code__] = name
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            wall, cpu = time.perf_counter(), time.thread_time()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with _lock:
+                    totals = _spans[name]
+                    totals[0] += 1
+                    totals[1] += time.perf_counter() - wall
+                    totals[2] += time.thread_time() - cpu
+        return wrapper
+    return decorate
+
+# Deliberate sleeps all go through RunMetrics.sleep; threads parked on a condition are idle
+_SLEEP_CODE = RunMetrics.sleep.__code__
+_IDLE_FUNCTIONS = {"wait", "_wait_for_tstate_lock", "join"}
+_THREAD_NUMBER = re.compile(r"[-_]\d+$")
+
+def _label(code) -> str:
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class StackSampler:
+    """Samples every thread's Python stack at a fixed interval and counts collapsed stacks.
+
+    Samples taken while a thread sleeps deliberately or waits on a queue or condition are
+    only counted, not added to the stacks, so the flame graph shows where time is worked.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: _THREAD_NUMBER.sub("", thread.name) for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    self._sample(names.get(ident, "thread"), frame)
+
+    def _sample(self, thread_name: str, frame) -> None:
+        leaf = frame.f_code
+        if leaf.co_filename.endswith("threading.py") and leaf.co_name in _IDLE_FUNCTIONS:
+            self.samples["idle"] += 1
+            return
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            if code is _SLEEP_CODE:
+                self.samples["sleep"] += 1
+                return
+            if code.co_name != "wrapper" or code.co_filename != __file__:
+                stack.append(_label(code))
+                if code in _span_codes:
+                    stack.append(f"[span {_span_codes[code]}]")
+            frame = frame.f_back
+        self.samples["active"] += 1
+        self.stacks[";".join([thread_name] + stack[::-1])] += 1
+
+    def write(self, path: str) -> None:
+        """Write the stacks in collapsed format, as read by flamegraph.pl and speedscope."""
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+def write_report(profiler: cProfile.Profile, sampler: StackSampler, directory: str) -> None:
+    os.makedirs(directory, exist_ok=True)
+    profiler.dump_stats(os.path.join(directory, "profile.pstats"))
+    sampler.write(os.path.join(directory, "profile.collapsed"))
+
+    text = io.StringIO()
+    stats = pstats.Stats(profiler, stream=text).sort_stats("cumulative")
+    stats.print_stats(50)
+    with open(os.path.join(directory, "profile.txt"), "w") as f:
+        f.write(text.getvalue())
+
+    with _lock:
+        spans = {
+            name: {"calls": calls, "wall_seconds": round(wall, 4), "cpu_seconds": round(cpu, 4)}
+            for name, (calls, wall, cpu) in sorted(_spans.items())
+        }
+    samples = dict(sampler.samples)
+    with open(os.path.join(directory, "profile.json"), "w") as f:
+        json.dump({"interval_ms": PROFILE_INTERVAL_MS, "samples": samples, "spans": spans}, f, indent=2)
+
+    for name, totals in spans.items():
+        logging.info("Span %s: %s calls, %.2fs wall, %.2fs CPU", name, totals["calls"], totals["wall_seconds"], totals["cpu_seconds"])
+    logging.info("Stack samples: %s active, %s in deliberate sleeps, %s idle",
+                 samples.get("active", 0), samples.get("sleep", 0), samples.get("idle", 0))
+    logging.info("Profile written to %s", directory)
+
+def run(main: Callable[[], T]) -> T:
+    """Call ``main``, under cProfile and the stack sampler when SYNC_PROFILE_DIR is set."""
+    if not PROFILE_DIR:
+        return main()
+    # From Python 3.12 cProfile records every thread, so pipeline workers are included
+    profiler = cProfile.Profile()
+    sampler = StackSampler(PROFILE_INTERVAL_MS / 1000)
+    sampler.start()
+    profiler.enable()
+    try:
+        return main()
+    finally:
+        profiler.disable()
+        sampler.stop()
+        write_report(profiler, sampler, PROFILE_DIR)
@@ -0,0 +1,50 @@
+import re
+from typing import Any, Dict
+
+# Server-managed fields that never count as a change
+IGNORED_KEYS = {
+    "lock_version", "uri", "system_mtime", "user_mtime", "create_time",
+    "created_by", "last_modified_by", "persistent_id",
+}
+
+# Text that differs on every run without the record itself changing
+VOLATILE_PATTERNS = [
+    # "Indexed:" date in the originalsloc note
+    (re.compile(r"(<emph>Indexed: </emph><date>)[^<]*(</date>)"), r"\1\2"),
+    # Timestamp in repository_processing_note
+    (re.compile(r"(automated script on )\d{4}-\d{2}-\d{2}(?:-\d{2}-\d{2})?"), r"\1"),
+]
+
+def normalize(value: Any) -> Any:
+    """Strip volatile text and surrounding whitespace from strings; leave other scalars alone."""
+    if isinstance(value, str):
+        for pattern, replacement in VOLATILE_PATTERNS:
+            value = pattern.sub(replacement, value)
+        return value.strip()
+    return value
+
+def is_subset(new: Any, existing: Any) -> bool:
+    """True when every field set in ``new`` already has the same normalized value in ``existing``.
+
+    Dicts are compared on the keys ``new`` sets, so fields ArchivesSpace adds to stored records
+    do not count as differences. Lists must have the same length and match item by item.
+    """
+    if isinstance(new, dict):
+        if not isinstance(existing, dict):
+            return False
+        return all(
+            is_subset(value, existing.get(key))
+            for key, value in new.items()
+            if key not in IGNORED_KEYS and not key.startswith("_")
+        )
+    if isinstance(new, list):
+        if not isinstance(existing, list) or len(new) != len(existing):
+            return False
+        return all(is_subset(a, b) for a, b in zip(new, existing))
+    if new is None or new == "":
+        return existing is None or existing == ""
+    return normalize(new) == normalize(existing)
+
+def has_changes(existing: Dict[str, Any], new: Dict[str, Any]) -> bool:
+    """Whether posting ``{**existing, **new}`` would change anything meaningful."""
+    return not is_subset(new, existing)
@@ -0,0 +1,157 @@
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, Optional, TypeVar
+
+import requests
+
+from metrics import run_metrics
+
+T = TypeVar("T")
+
+class CircuitOpenError(Exception):
+    """Raised when the circuit breaker has stayed open for longer than it is allowed to."""
+
+def is_retryable(error: Exception) -> bool:
+    """Server errors, throttling and transport failures are retried; other errors fail fast."""
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status >= 500 or status in (408, 429)
+    return isinstance(error, (
+        requests.exceptions.ConnectionError,
+        requests.exceptions.Timeout,
+        requests.exceptions.ChunkedEncodingError,
+    ))
+
+class RetryMetrics:
+    """Thread-safe counters for attempts, retries, failures and breaker activity."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Counter = Counter()
+
+    def incr(self, name: str, amount: float = 1) -> None:
+        with self._lock:
+            self._counts[name] += amount
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._counts)
+
+class CircuitBreaker:
+    """Stops all traffic after repeated retryable failures and lets a single probe through later.
+
+    While open, callers block in ``before_request``. After ``reset_seconds`` one caller is let
+    through as a probe; its success closes the breaker, its failure re-opens it. If the breaker
+    has been open for ``max_open_seconds`` in total, callers get ``CircuitOpenError``.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float, max_open_seconds: float,
+                 metrics: Optional[RetryMetrics] = None, name: str = "circuit"):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self.max_open_seconds = max_open_seconds
+        self.metrics = metrics or RetryMetrics()
+        self.name = name
+        self._cond = threading.Condition()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._open_since: Optional[float] = None
+        self._probing = False
+
+    def before_request(self) -> None:
+        with self._cond:
+            waited_from = None
+            while self._opened_at is not None:
+                now = time.monotonic()
+                waited_from = waited_from or now
+                if now - self._open_since >= self.max_open_seconds:
+                    raise CircuitOpenError(f"{self.name} has been unavailable for {now - self._open_since:.0f}s")
+                if not self._probing and now - self._opened_at >= self.reset_seconds:
+                    self._probing = True
+                    logging.info("%s: sending probe request", self.name)
+                    break
+                remaining = self.reset_seconds - (now - self._opened_at)
+                self._cond.wait(timeout=remaining if not self._probing and remaining > 0 else 1)
+            if waited_from is not None:
+                self.metrics.incr("breaker_wait_seconds", time.monotonic() - waited_from)
+                run_metrics.add_sleep("circuit_breaker", time.monotonic() - waited_from)
+
+    def record_success(self) -> None:
+        with self._cond:
+            if self._opened_at is not None:
+                logging.info("%s: probe succeeded, resuming traffic", self.name)
+                self.metrics.incr("breaker_closed")
+            self._failures = 0
+            self._opened_at = self._open_since = None
+            self._probing = False
+            self._cond.notify_all()
+
+    def record_failure(self) -> None:
+        with self._cond:
+            now = time.monotonic()
+            if self._probing:
+                self._probing = False
+                self._opened_at = now
+                logging.warning("%s: probe failed, pausing traffic for %ss", self.name, self.reset_seconds)
+                self._cond.notify_all()
+                return
+            if self._opened_at is not None:
+                return  # Requests already in flight when the breaker opened
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                self._opened_at = self._open_since = now
+                self.metrics.incr("breaker_opened")
+                logging.warning("%s: %s consecutive failures, pausing traffic for %ss",
+                                self.name, self._failures, self.reset_seconds)
+
+class RetryPolicy:
+    """Retries retryable errors with capped exponential backoff and full jitter."""
+
+    def __init__(self, max_attempts: int, base_delay: float, max_delay: float, timeout: float,
+                 breaker: Optional[CircuitBreaker] = None, metrics: Optional[RetryMetrics] = None):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.metrics = metrics or (breaker.metrics if breaker else RetryMetrics())
+        self.breaker = breaker
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def call(self, fn: Callable[[], T], label: str) -> T:
+        """Run ``fn`` until it succeeds, fails with a non-retryable error, or attempts run out."""
+        attempt = 0
+        while True:
+            if self.breaker:
+                self.breaker.before_request()
+            attempt += 1
+            self.metrics.incr("attempts")
+            try:
+                result = fn()
+            except Exception as e:
+                retryable = is_retryable(e)
+                if self.breaker and retryable:
+                    self.breaker.record_failure()
+                elif self.breaker:
+                    # A fast failure such as a 404 still proves the server is answering
+                    self.breaker.record_success()
+                if not retryable:
+                    self.metrics.incr("fast_failures")
+                    logging.error("%s failed: %s", label, e)
+                    raise
+                if attempt >= self.max_attempts:
+                    self.metrics.incr("exhausted")
+                    logging.error("%s failed after %d attempts: %s", label, attempt, e)
+                    raise
+                delay = self.backoff(attempt)
+                self.metrics.incr("retries")
+                logging.warning("Attempt %d for %s failed: %s; retrying in %.1fs", attempt, label, e, delay)
+                run_metrics.sleep(delay, "retry_backoff")
+            else:
+                if self.breaker:
+                    self.breaker.record_success()
+                return result
@@ -1,45 +1,184 @@
 # state_manager.py
 
 import json
+import logging
 import os
-from typing import TypedDict
+from typing import Any, Dict, Iterable, List, TypedDict
+
+from access_points import AccessPointRegistry
+from profiling import span
 
 STATE_FILE = "state.json"
+# Append-only log of changes made since state.json was last written
+JOURNAL_FILE = "state.journal"
+# Journal entries written before they are folded back into state.json
+COMPACT_EVERY = int(os.getenv("STATE_COMPACT_EVERY", "5000"))
 
 class State(TypedDict, total=False):
     skip: int
     page_limit: int
     total: int | None
+    mode: str | None
+    run_started: str | None
+    watermark: str | None
+    last_full_sync: str | None
+    phase: str | None
+    fetch_failures: int
 
 # define the shape of your initial state
 INITIAL_STATE: State = {
     "skip": 0,
     "page_limit": 30,
     "total": None,
+    "mode": None,
+    "run_started": None,
+    "watermark": None,
+    "last_full_sync": None,
+    "phase": None,
+    "fetch_failures": 0,
 }
 
+# Keys carried across resets so the next run knows what has already been synced
+PERSISTENT_KEYS = ("watermark", "last_full_sync")
+
+# Items of the current phase that are finished; cleared when the next phase starts
+DONE_KEY = "done"
+# Per-record term lists kept before the access point registry; folded into it on load
+LEGACY_KEYS = ("unique_subjects", "unique_places", "unique_names")
+
+# Journal lines recorded since the last checkpoint, and lines already in the journal file
+_pending: List[str] = []
+_journal_entries = 0
+# Incremented on every compaction; a journal only applies to the snapshot of the same generation
+_generation = 0
+
+def _write_atomic(path: str, text: str) -> None:
+    """Replace ``path`` so readers see either the old or the new content, never a torn write."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def _parse(line: str) -> Dict[str, Any] | None:
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+def _apply(state: Dict[str, Any], entry: Dict[str, Any]) -> None:
+    if "set" in entry:
+        state.update(entry["set"])
+    if "record" in entry:
+        state["access_points"].restore(entry["record"], entry["links"], entry.get("terms", ()))
+    if "phase" in entry:
+        state["phase"] = entry["phase"]
+        state[DONE_KEY] = set()
+    if "done" in entry:
+        state[DONE_KEY].add(entry["done"])
+
 def load_state() -> State:
-    """Load state from disk, or return a fresh initial state."""
+    """Load the last snapshot and replay the journal on top of it, or return a fresh initial state."""
+    global _journal_entries, _generation
+    state: Dict[str, Any] = INITIAL_STATE.copy()
     if os.path.exists(STATE_FILE):
-        with open(STATE_FILE, "r") as f:
-            state = json.load(f)
-            # Convert lists back to sets for specific keys
-            state["unique_subjects"] = set(state.get("unique_subjects", []))
-            state["unique_places"] = set(state.get("unique_places", []))
-            state["unique_names"] = set(state.get("unique_names", []))
-            return state
-    return INITIAL_STATE.copy()
+        try:
+            with open(STATE_FILE, "r") as f:
+                state.update(json.load(f))
+        except ValueError as e:
+            # Only files written before snapshots were atomic can be torn; start a full sync over
+            logging.warning("%s is unreadable (%s); starting from the initial state.", STATE_FILE, e)
+    state[DONE_KEY] = set(state.get(DONE_KEY, []))
+    state["access_points"] = AccessPointRegistry.from_json(state.get("access_points") or {})
+    for key in LEGACY_KEYS:
+        state.pop(key, None)
+    _generation = state.pop("generation", 0)
+
+    _pending.clear()
+    _journal_entries = 0
+    torn = False
+    if os.path.exists(JOURNAL_FILE):
+        with open(JOURNAL_FILE, "r") as f:
+            lines = iter(f)
+            header = _parse(next(lines, ""))
+            # A journal from an older generation was already folded into the snapshot
+            if header and header.get("generation") == _generation:
+                for line in lines:
+                    if (entry := _parse(line)) is None:
+                        torn = True  # A crash mid-append leaves at most one torn line at the end
+                        break
+                    _apply(state, entry)
+                    _journal_entries += 1
+    if torn:
+        # Appending after the torn line would hide every later entry, so start a clean journal
+        compact_state(state)
+    return state
 
+@span("state.access_points")
+def record_progress(state: State, id_0: str, terms: Dict[str, Iterable[str]]) -> None:
+    """Register a record's access point terms, by role, and queue them for the next checkpoint."""
+    links, new_terms = state["access_points"].add(id_0, terms)
+    entry: Dict[str, Any] = {"record": id_0, "links": links}
+    if new_terms:
+        entry["terms"] = new_terms
+    _pending.append(json.dumps(entry, separators=(",", ":")))
+
+def enter_phase(state: State, phase: str) -> None:
+    """Start ``phase`` and checkpoint it, forgetting which items of the previous phase were done."""
+    state["phase"] = phase
+    state[DONE_KEY] = set()
+    _pending.append(json.dumps({"phase": phase}))
+    save_state(state)
+
+def is_done(state: State, key: str) -> bool:
+    return key in state.get(DONE_KEY, ())
+
+def mark_done(state: State, key: str) -> None:
+    """Mark an item of the current phase as finished; it is journaled at the next checkpoint."""
+    state.setdefault(DONE_KEY, set()).add(key)
+    _pending.append(json.dumps({"done": key}))
+
+@span("state.save")
 def save_state(state: State) -> None:
-    """Persist the given state dict to disk."""
-    # Convert sets to lists before saving state
-    state["unique_subjects"] = list(state.get("unique_subjects", []))
-    state["unique_places"] = list(state.get("unique_places", []))
-    state["unique_names"] = list(state.get("unique_names", []))
-    
-    with open(STATE_FILE, "w") as f:
-        json.dump(state, f, indent=2)
-
-def reset_state() -> None:
-    """Overwrite state.json with the initial default values."""
-    save_state(INITIAL_STATE.copy())
+    """Checkpoint ``state`` by appending the records and counters changed since the last call.
+
+    The cost depends on what changed, not on the size of the run; every ``COMPACT_EVERY``
+    entries the journal is folded into a fresh ``state.json``.
+    """
+    global _journal_entries
+    lines = _pending + [json.dumps({"set": {key: state.get(key) for key in INITIAL_STATE}})]
+    if not os.path.exists(JOURNAL_FILE):
+        _write_atomic(JOURNAL_FILE, json.dumps({"generation": _generation}) + "\n")
+    with open(JOURNAL_FILE, "a") as f:
+        f.write("\n".join(lines) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    _pending.clear()
+    _journal_entries += len(lines)
+    if _journal_entries >= COMPACT_EVERY:
+        compact_state(state)
+
+@span("state.compact")
+def compact_state(state: State) -> None:
+    """Write the whole of ``state`` to state.json atomically and empty the journal."""
+    global _journal_entries, _generation
+    _generation += 1
+    snapshot = {key: value for key, value in state.items() if key not in (DONE_KEY, "access_points")}
+    snapshot[DONE_KEY] = sorted(state.get(DONE_KEY, ()))
+    if "access_points" in state:
+        snapshot["access_points"] = state["access_points"].to_json()
+    snapshot["generation"] = _generation
+    _write_atomic(STATE_FILE, json.dumps(snapshot, separators=(",", ":")))
+    # Until the new header is written, the old journal no longer matches and is ignored on load
+    _write_atomic(JOURNAL_FILE, json.dumps({"generation": _generation}) + "\n")
+    _pending.clear()
+    _journal_entries = 0
+
+def reset_state(state: State | None = None) -> None:
+    """Overwrite state.json with the initial default values, keeping persistent keys from ``state``."""
+    fresh = INITIAL_STATE.copy()
+    for key in PERSISTENT_KEYS:
+        if state and state.get(key) is not None:
+            fresh[key] = state[key]
+    compact_state(fresh)
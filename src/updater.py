@@ -1,7 +1,43 @@
 import json
 import logging
-from typing import Any, Dict
+import os
+import threading
+from collections import Counter
+from functools import partial
+from typing import Any, Callable, Dict, Optional
+from aspace_index import IndexEntry, Namespace
+from bulk_import import BulkCreator
 from cache import client, REPO_ID
+from record_diff import has_changes
+
+# How many times an update is re-merged and retried after a 409 conflict
+CONFLICT_RETRIES = int(os.getenv("ASPACE_CONFLICT_RETRIES", "3"))
+
+# New records per batch import; 0 creates every record with its own POST
+BULK_CREATE_SIZE = int(os.getenv("ASPACE_BULK_CREATE_SIZE", "0"))
+
+CREATE_PATHS = {
+    "resource": f"/repositories/{REPO_ID}/resources",
+    "subject": "/subjects",
+    "corporate agent": "/agents/corporate_entities",
+}
+
+# Outcome counts per record kind, e.g. ("resource", "skipped"); written by every write worker
+write_stats: Counter = Counter()
+_stats_lock = threading.Lock()
+
+def count_write(kind: str, outcome: str) -> None:
+    # Counter increments are read-modify-write, so concurrent workers would lose counts
+    with _stats_lock:
+        write_stats[kind, outcome] += 1
+
+def log_write_stats() -> None:
+    for kind in ("resource", "subject", "corporate agent"):
+        logging.info(
+            "%s writes: %s created, %s updated, %s skipped as unchanged, %s conflicts, %s records fetched",
+            kind.capitalize(), write_stats[kind, "created"], write_stats[kind, "updated"], write_stats[kind, "skipped"],
+            write_stats[kind, "conflicts"], write_stats[kind, "fetched"],
+        )
 
 def fetch_existing_data(uri: str) -> Dict[str, Any]:
     """Fetch the existing data for a given URI."""
@@ -12,67 +48,132 @@ def fetch_existing_data(uri: str) -> Dict[str, Any]:
         logging.error("Failed to fetch existing data for URI %s: %s", uri, resp.text)
         return {}
 
-def update_resource(rsrc: Dict[str, Any], meta: Dict[str, Any]) -> None:
-    existing_data = fetch_existing_data(meta["uri"])
-    if not existing_data:
-        logging.error("Cannot update resource %s: Failed to fetch existing data", rsrc["id_0"])
-        return
+def update_record(kind: str, payload: Dict[str, Any] | Callable[[Dict[str, Any]], Dict[str, Any]],
+                  entry: IndexEntry, namespace: Namespace) -> bool:
+    """Merge ``payload`` into the last known record and post it against the cached lock_version.
 
-    # Fetch the latest lock_version
-    latest_lock_version = existing_data.get("lock_version")
-    if latest_lock_version is None:
-        logging.error("Cannot update resource %s: Missing lock_version", rsrc["id_0"])
-        return
+    ``payload`` may also be a function building the fields to merge from the existing record.
+    The stored record is only refetched when ArchivesSpace answers 409, i.e. someone else
+    changed it since it was indexed; the merge and write are then retried a bounded number
+    of times.
+    """
+    ident = entry.key
+    build = payload if callable(payload) else lambda existing: payload
+    existing_data = namespace.record(entry)
+    if existing_data is None:
+        # Nothing stored for this entry yet; fall back to reading the current record
+        count_write(kind, "fetched")
+        existing_data = fetch_existing_data(entry.uri)
+        if not existing_data or existing_data.get("lock_version") is None:
+            logging.error("Cannot update %s %s: Failed to fetch existing data", kind, ident)
+            return False
+        namespace.remember(entry, existing_data["lock_version"], existing_data)
 
-    # Merge existing data with the new data
-    updated_data = {**existing_data, **rsrc}
-    updated_data["uri"] = meta["uri"]
-    updated_data["lock_version"] = latest_lock_version
+    for _ in range(CONFLICT_RETRIES + 1):
+        payload = build(existing_data)
+        if not has_changes(existing_data, payload):
+            count_write(kind, "skipped")
+            logging.info("No changes for %s %s; skipping write", kind, ident)
+            return True
 
-    resp = client.post(meta["uri"], json=updated_data)
-    if resp.ok:
-        logging.info("✔ Updated %s", rsrc["id_0"])
-    elif resp.status_code == 409 and "modified since you fetched it" in resp.text:
-        logging.warning("Conflict detected for %s. Refetching lock_version and retrying.", rsrc["id_0"])
-        # Refetch the latest lock_version and retry
-        existing_data = fetch_existing_data(meta["uri"])
-        latest_lock_version = existing_data.get("lock_version")
-        if latest_lock_version is None:
-            logging.error("Cannot update resource %s: Missing lock_version after refetch", rsrc["id_0"])
-            return
-
-        updated_data["lock_version"] = latest_lock_version
-        resp = client.post(meta["uri"], json=updated_data)
+        # Merge existing data with the new data
+        updated_data = {**existing_data, **payload}
+        updated_data["uri"] = entry.uri
+        updated_data["lock_version"] = entry.lock_version
+
+        resp = client.post(entry.uri, json=updated_data)
         if resp.ok:
-            logging.info("✔ Updated %s after retry", rsrc["id_0"])
-        else:
-            logging.error("✖ Update failed for %s after retry: %s", rsrc["id_0"], resp.text)
-    else:
-        logging.error("✖ Update failed for %s: %s", rsrc["id_0"], resp.text)
+            namespace.remember(entry, resp.json().get("lock_version", entry.lock_version + 1), updated_data)
+            count_write(kind, "updated")
+            logging.info("✔ Updated %s %s", kind, ident)
+            return True
+        if resp.status_code != 409:
+            logging.error("✖ Update failed for %s %s: %s", kind, ident, resp.text)
+            return False
 
-def upsert_resource(rsrc: Dict[str, Any], cache: Dict[str, Dict[str, Any]]) -> None:
-    ident = rsrc["id_0"]
-    if ident in cache:
-        return update_resource(rsrc, cache[ident])
-    resp = client.post(f"/repositories/{REPO_ID}/resources", json=rsrc)
+        count_write(kind, "conflicts")
+        logging.warning("Conflict detected for %s %s. Refetching and merging again.", kind, ident)
+        existing_data = fetch_existing_data(entry.uri)
+        if existing_data.get("lock_version") is None:
+            logging.error("Cannot update %s %s: Missing lock_version after refetch", kind, ident)
+            return False
+        namespace.remember(entry, existing_data["lock_version"], existing_data)
+
+    logging.error("✖ Update failed for %s %s: still conflicting after %s retries", kind, ident, CONFLICT_RETRIES)
+    return False
+
+def update_resource(rsrc: Dict[str, Any], entry: IndexEntry, namespace: Namespace) -> bool:
+    return update_record("resource", rsrc, entry, namespace)
+
+def record_created(kind: str, ident: str, payload: Dict[str, Any], namespace: Namespace, uri: str, rid: int,
+                   lock_version: int = 0) -> None:
+    namespace.add(ident, rid, uri, lock_version, {**payload, "uri": uri})
+    count_write(kind, "created")
+    logging.info("✔ Created %s %s", kind, ident)
+
+def post_create(kind: str, ident: str, payload: Dict[str, Any], namespace: Namespace) -> bool:
+    resp = client.post(CREATE_PATHS[kind], json=payload)
     if resp.ok:
         body = resp.json()
-        cache[ident] = {
-            "rid": body["id"], "uri": body["uri"], "lock_ver": body["lock_version"]
-        }
-        logging.info("✔ Created %s", ident)
-    else:
-        logging.error("✖ Create failed for %s: %s", ident, resp.text)
+        record_created(kind, ident, payload, namespace, body["uri"], body["id"], body["lock_version"])
+        return True
+    logging.error("✖ Create failed for %s %s: %s", kind, ident, resp.text)
+    return False
+
+bulk_creator = (
+    BulkCreator(client, REPO_ID, BULK_CREATE_SIZE, CREATE_PATHS, post_create, record_created)
+    if BULK_CREATE_SIZE > 0 else None
+)
+
+def create_record(kind: str, ident: str, payload: Dict[str, Any], namespace: Namespace,
+                  on_created: Optional[Callable[[], None]] = None, defer: bool = True) -> bool:
+    """Create a record now, or queue it for the next batch import when bulk creation is enabled.
+
+    ``on_created`` runs once the record exists, which for a queued record is after the flush.
+    """
+    if bulk_creator and bulk_creator.is_pending(kind, ident):
+        # The same identifier is already queued; create it first and update it with this payload
+        flush_bulk_creates()
+        if ident in namespace:
+            return update_record(kind, payload, namespace[ident], namespace)
+    if defer and bulk_creator:
+        bulk_creator.add(kind, ident, payload, namespace, on_created)
+        return True
+    if not post_create(kind, ident, payload, namespace):
+        return False
+    if on_created:
+        on_created()
+    return True
+
+def flush_bulk_creates() -> None:
+    """Create every queued record; call before anything needs their URIs."""
+    if bulk_creator:
+        bulk_creator.flush()
 
-def delete_resource(meta: Dict[str, Any]) -> None:
-    resp = client.delete(meta["uri"])
+def upsert_resource(rsrc: Dict[str, Any], namespace: Namespace, on_written: Optional[Callable[[], None]] = None) -> bool:
+    """Create or update a resource, returning whether the write was accepted (or queued for a batch import).
+
+    ``on_written`` runs once ArchivesSpace holds the record.
+    """
+    ident = rsrc["id_0"]
+    if ident in namespace:
+        if not update_resource(rsrc, namespace[ident], namespace):
+            return False
+        if on_written:
+            on_written()
+        return True
+    return create_record("resource", ident, rsrc, namespace, on_written)
+
+def delete_resource(entry: IndexEntry, namespace: Namespace) -> None:
+    resp = client.delete(entry.uri)
     if resp.ok:
-        logging.info("✔ Deleted resource with id_0: %s", meta["id_0"])
+        namespace.remove(entry)
+        logging.info("✔ Deleted resource with id_0: %s", entry.key)
     else:
-        logging.error("✖ Failed to delete resource with id_0: %s", meta["id_0"])
+        logging.error("✖ Failed to delete resource with id_0: %s", entry.key)
 
-def create_subject(subject: Dict[str, Any], cache: Dict[str, Dict[str, Any]]) -> None:
-    payload = {
+def subject_payload(subject: Dict[str, Any]) -> Dict[str, Any]:
+    return {
         "jsonmodel_type": "subject",
         "external_ids": [],
         "publish": True,
@@ -92,56 +193,32 @@ def create_subject(subject: Dict[str, Any], cache: Dict[str, Dict[str, Any]]) ->
         "source": subject.get("source", "lcsh")
     }
 
-    resp = client.post(f"/subjects", json=payload)
-    if resp.ok:
-        body = resp.json()
-        cache[subject["id_0"]] = {
-            "sid": body["id"], "uri": body["uri"], "lock_ver": body["lock_version"]
-        }
-        logging.info("✔ Created subject %s", subject["id_0"])
-    else:
-        logging.error("✖ Create failed for subject %s: %s", subject["id_0"], resp.text)
+def create_subject(subject: Dict[str, Any], namespace: Namespace, defer: bool = True) -> bool:
+    return create_record("subject", subject["id_0"], subject_payload(subject), namespace, defer=defer)
 
-def update_subject(subject: Dict[str, Any], meta: Dict[str, Any]) -> None:
-    existing_data = fetch_existing_data(meta["uri"])
-    if not existing_data:
-        logging.error("Cannot update subject %s: Failed to fetch existing data", subject["id_0"])
-        return
+def subject_changes(subject: Dict[str, Any], existing: Dict[str, Any]) -> Dict[str, Any]:
+    """The fields the sync sets on ``subject``: its source and the first term's type, merged over ``existing``."""
+    terms = existing.get("terms") or subject_payload(subject)["terms"]
+    first = {**terms[0], "term_type": subject.get("term_type", "topical")}
+    return {"source": subject.get("source", "lcsh"), "terms": [first] + terms[1:]}
 
-    # Merge existing data with the new data
-    updated_data = {**existing_data, **subject}
-    updated_data["uri"] = meta["uri"]
-    updated_data["lock_version"] = meta["lock_ver"]
+def update_subject(subject: Dict[str, Any], entry: IndexEntry, namespace: Namespace) -> bool:
+    """Bring an existing subject's source and first term type in line with ``subject``.
 
-    resp = client.post(meta["uri"], json=updated_data)
-    if resp.ok:
-        logging.info("✔ Updated subject %s", subject["id_0"])
-    elif resp.status_code == 409 and "modified since you fetched it" in resp.text:
-        logging.warning("Conflict detected for subject %s. Refetching lock_version and retrying.", subject["id_0"])
-        # Refetch the latest lock_version and retry
-        existing_data = fetch_existing_data(meta["uri"])
-        latest_lock_version = existing_data.get("lock_version")
-        if latest_lock_version is None:
-            logging.error("Cannot update subject %s: Missing lock_version after refetch", subject["id_0"])
-            return
-
-        updated_data["lock_version"] = latest_lock_version
-        resp = client.post(meta["uri"], json=updated_data)
-        if resp.ok:
-            logging.info("✔ Updated subject %s after retry", subject["id_0"])
-        else:
-            logging.error("✖ Update failed for subject %s after retry: %s", subject["id_0"], resp.text)
-    else:
-        logging.error("✖ Update failed for subject %s: %s", subject["id_0"], resp.text)
+    These are the only attributes the sync sets on subjects, so a subject that already
+    matches is skipped without a write.
+    """
+    return update_record("subject", partial(subject_changes, subject), entry, namespace)
 
-def delete_subject(meta: Dict[str, Any]) -> None:
-    resp = client.delete(meta["uri"])
+def delete_subject(entry: IndexEntry, namespace: Namespace) -> None:
+    resp = client.delete(entry.uri)
     if resp.ok:
-        logging.info("✔ Deleted subject with id_0: %s", meta["id_0"])
+        namespace.remove(entry)
+        logging.info("✔ Deleted subject with id_0: %s", entry.key)
     else:
-        logging.error("✖ Failed to delete subject with id_0: %s", meta["id_0"])
+        logging.error("✖ Failed to delete subject with id_0: %s", entry.key)
 
-def create_corporate_agent(agent: Dict[str, Any], cache: Dict[str, Dict[str, Any]]) -> None:
+def create_corporate_agent(agent: Dict[str, Any], namespace: Namespace, defer: bool = True) -> bool:
     # Ensure the 'names' field has at least one item
     names = agent.get("names", [])
     if not names:
@@ -164,51 +241,18 @@ def create_corporate_agent(agent: Dict[str, Any], cache: Dict[str, Dict[str, Any
         "agent_type": "agent_corporate_entity"
     }
 
-    resp = client.post(f"/agents/corporate_entities", json=payload)
-    if resp.ok:
-        body = resp.json()
-        cache[agent["id_0"]] = {
-            "aid": body["id"], "uri": body["uri"], "lock_ver": body["lock_version"]
-        }
-        logging.info("✔ Created corporate agent %s", agent["id_0"])
-    else:
-        logging.error("✖ Create failed for corporate agent %s: %s", agent["id_0"], resp.text)
-
-def update_corporate_agent(agent: Dict[str, Any], meta: Dict[str, Any]) -> None:
-    existing_data = fetch_existing_data(meta["uri"])
-    if not existing_data:
-        logging.error("Cannot update corporate agent %s: Failed to fetch existing data", agent["id_0"])
-        return
+    return create_record("corporate agent", agent["id_0"], payload, namespace, defer=defer)
 
-    # Merge existing data with the new data
-    updated_data = {**existing_data, **agent}
-    updated_data["uri"] = meta["uri"]
-    updated_data["lock_version"] = meta["lock_ver"]
-
-    resp = client.post(meta["uri"], json=updated_data)
-    if resp.ok:
-        logging.info("✔ Updated corporate agent %s", agent["id_0"])
-    elif resp.status_code == 409 and "modified since you fetched it" in resp.text:
-        logging.warning("Conflict detected for corporate agent %s. Refetching lock_version and retrying.", agent["id_0"])
-        # Refetch the latest lock_version and retry
-        existing_data = fetch_existing_data(meta["uri"])
-        latest_lock_version = existing_data.get("lock_version")
-        if latest_lock_version is None:
-            logging.error("Cannot update corporate agent %s: Missing lock_version after refetch", agent["id_0"])
-            return
-
-        updated_data["lock_version"] = latest_lock_version
-        resp = client.post(meta["uri"], json=updated_data)
-        if resp.ok:
-            logging.info("✔ Updated corporate agent %s after retry", agent["id_0"])
-        else:
-            logging.error("✖ Update failed for corporate agent %s after retry: %s", agent["id_0"], resp.text)
-    else:
-        logging.error("✖ Update failed for corporate agent %s: %s", agent["id_0"], resp.text)
+def update_corporate_agent(agent: Dict[str, Any], entry: IndexEntry, namespace: Namespace) -> bool:
+    """Agents are matched on their primary name and the sync sets nothing else, so existing agents are not written."""
+    count_write("corporate agent", "skipped")
+    logging.info("No changes for corporate agent %s; skipping write", entry.key)
+    return True
 
-def delete_corporate_agent(meta: Dict[str, Any]) -> None:
-    resp = client.delete(meta["uri"])
+def delete_corporate_agent(entry: IndexEntry, namespace: Namespace) -> None:
+    resp = client.delete(entry.uri)
     if resp.ok:
-        logging.info("✔ Deleted corporate agent with id_0: %s", meta["id_0"])
+        namespace.remove(entry)
+        logging.info("✔ Deleted corporate agent with id_0: %s", entry.key)
     else:
-        logging.error("✖ Failed to delete corporate agent with id_0: %s", meta["id_0"])
+        logging.error("✖ Failed to delete corporate agent with id_0: %s", entry.key)